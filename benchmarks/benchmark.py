@@ -0,0 +1,203 @@
+"""Scaling benchmark of the create and subsample modules.
+
+Runs create and subsample on the subsampled alignments of
+BENCHMARKING.tar.gz and writes the time of each phase and the peak memory
+of every run to a JSON file, so runs of different commits can be compared.
+The phases of create are the ones of its --o-profile report, followed by a
+subsample by number of taxa and one by proportions of groups of the
+community file. Each alignment is run in its own process so the peak
+memory is its own.
+
+    python benchmarks/benchmark.py --p-sizes 50,100,250 --o-results results.json
+"""
+import sys
+import os
+import re
+import json
+import time
+import shutil
+import tarfile
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+benchmark_dir=os.path.dirname(os.path.abspath(__file__))
+repository_dir=os.path.dirname(benchmark_dir)
+sys.path.insert(0, repository_dir)
+
+from disco_microbe._version import __version__
+from disco_microbe import disco_microbe
+
+alignmentname=re.compile(r"^Subsampled_community_taxa(\d+)\.fasta$")
+
+def main():
+    parser=argparse.ArgumentParser(description="Time create and subsample on the BENCHMARKING alignments")
+    parser.add_argument("--i-archive", dest="archive", default=os.path.join(repository_dir, "BENCHMARKING.tar.gz"),
+                        help="Archive of the benchmark alignments. Default: BENCHMARKING.tar.gz of the repository")
+    parser.add_argument("--i-alignments", dest="alignments",
+                        help="Directory of already extracted benchmark alignments, used instead of --i-archive")
+    parser.add_argument("--p-sizes", type=sizeList, dest="sizes",
+                        help="Comma separated alignment sizes to run. Default: every size in the archive")
+    parser.add_argument("--p-editdistance", type=int, default=3, dest="edit_value",
+                        help="Edit distance of the communities. Default: 3")
+    parser.add_argument("--p-seed", type=int, default=10, dest="seed", help="Seed of create and subsample. Default: 10")
+    parser.add_argument("--p-distance-engine", choices=["python", "numpy"], default="python", dest="engine",
+                        help="Engine used to calculate pairwise distances. Default: python")
+    parser.add_argument("--p-jobs", type=int, default=1, dest="jobs", help="Number of processes calculating distances. Default: 1")
+    parser.add_argument("--p-threshold-mode", action="store_true", dest="threshold", default=False,
+                        help="Only keep pairs within the edit distance, no distance database is written")
+    parser.add_argument("--p-block-index", action="store_true", dest="block_index", default=False,
+                        help="Use the block index, with --p-threshold-mode")
+    parser.add_argument("--p-repeats", type=int, default=1, dest="repeats", help="Number of runs of each size. Default: 1")
+    parser.add_argument("--o-results", dest="results", default="benchmark_results.json",
+                        help="JSON file of the results. Default: benchmark_results.json")
+    parser.add_argument("--run-alignment", dest="run_alignment", help=argparse.SUPPRESS)
+    args=parser.parse_args()
+    if args.block_index and not args.threshold:
+        print("ERROR: --p-block-index must be used with --p-threshold-mode", file=sys.stderr)
+        sys.exit(1)
+    if args.run_alignment:
+        #a single run, in a process started by the benchmark
+        json.dump(runAlignment(args.run_alignment, args), sys.stdout)
+        return
+
+    data_dir=tempfile.mkdtemp(prefix="disco_benchmark_")
+    try:
+        alignments=benchmarkAlignments(args.alignments or extractArchive(args.archive, data_dir))
+        sizes=args.sizes or sorted(alignments)
+        missing=[size for size in sizes if size not in alignments]
+        if missing:
+            print("ERROR: No benchmark alignment of {} sequences. The sizes are {}".format(",".join(map(str, missing)), ",".join(map(str, sorted(alignments)))), file=sys.stderr)
+            sys.exit(1)
+        results=[]
+        for size in sizes:
+            for repeat in range(1, args.repeats+1):
+                print("Running {} sequences, repeat {}".format(size, repeat))
+                result=runChild(size, alignments[size], args, data_dir)
+                result.update(size=size, repeat=repeat)
+                results.append(result)
+                memory="\tpeak {:.1f} MB".format(result["peak_memory_mb"]) if result["peak_memory_mb"] is not None else ""
+                print("\t".join("{} {:.3f}s".format(phase, seconds) for phase, seconds in result["phases"].items())+memory)
+    finally:
+        shutil.rmtree(data_dir)
+    with open(args.results, "w") as results_file:
+        json.dump({"version": __version__,
+                   "commit": gitCommit(),
+                   "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": platform.python_version(),
+                   "numpy": np.__version__,
+                   "platform": platform.platform(),
+                   "cpus": os.cpu_count(),
+                   "options": {"editdistance": args.edit_value, "seed": args.seed, "engine": args.engine, "jobs": args.jobs,
+                               "threshold": args.threshold, "block_index": args.block_index},
+                   "results": results}, results_file, indent=2)
+    print("Results written to {}".format(args.results))
+
+def extractArchive(archive, data_dir):
+    #only the alignments are extracted, not the macOS resource files
+    with tarfile.open(archive) as benchmark_archive:
+        members=[member for member in benchmark_archive.getmembers()
+                 if member.isfile() and alignmentname.match(os.path.basename(member.name))]
+        for member in members:
+            member.name=os.path.basename(member.name)
+            benchmark_archive.extract(member, data_dir)
+    return data_dir
+
+def benchmarkAlignments(directory):
+    alignments={}
+    for name in os.listdir(directory):
+        match=alignmentname.match(name)
+        if match:
+            alignments[int(match.group(1))]=os.path.join(directory, name)
+    return alignments
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repository_dir, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def runChild(size, alignment, args, data_dir):
+    command=[sys.executable, os.path.abspath(__file__), "--run-alignment", alignment,
+             "--p-editdistance", str(args.edit_value), "--p-seed", str(args.seed),
+             "--p-distance-engine", args.engine, "--p-jobs", str(args.jobs)]
+    if args.threshold:
+        command.append("--p-threshold-mode")
+    if args.block_index:
+        command.append("--p-block-index")
+    #the run writes its files to its own directory, removed with the data
+    run_dir=tempfile.mkdtemp(dir=data_dir)
+    #messages of the run are only shown when it fails, with the traceback explaining why
+    run=subprocess.run(command, cwd=run_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    shutil.rmtree(run_dir)
+    if run.returncode:
+        print(run.stderr.decode(errors="replace"), file=sys.stderr)
+        print("ERROR: The run of {} sequences with the {} engine failed with exit status {}".format(size, args.engine, run.returncode), file=sys.stderr)
+        sys.exit(1)
+    return json.loads(run.stdout.decode())
+
+def sizeList(value):
+    #comma separated numbers of sequences of the benchmark alignments
+    try:
+        sizes=[int(size) for size in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {}".format(value))
+    if any(size < 1 for size in sizes):
+        raise argparse.ArgumentTypeError("invalid size: {}".format(value))
+    return sorted(set(sizes))
+
+def disco(*arguments):
+    #runs a module of disco in this process, as the command line would
+    sys.argv=["disco"]+list(arguments)
+    disco_microbe.main()
+
+def writeMetadata(alignment, path, group_count=4):
+    #the benchmark alignments have no metadata, so the sequences are spread over groups in turn
+    with open(alignment, "rb") as alignment_file, open(path, "w") as metadata_file:
+        metadata_file.write("ID\tGroup\n")
+        for position, (identifier, sequence) in enumerate(disco_microbe.readFasta(alignment_file)):
+            metadata_file.write("{}\tGroup{}\n".format(identifier, position % group_count+1))
+
+def runAlignment(alignment, args):
+    #create and subsample run as on the command line, messages of the modules are kept out of the results
+    stdout=sys.stdout
+    sys.stdout=sys.stderr
+    writeMetadata(alignment, "metadata.txt")
+    options=["--i-alignment", alignment, "--i-metadata", "metadata.txt", "--p-editdistance", str(args.edit_value),
+             "--p-seed", str(args.seed), "--p-distance-engine", args.engine, "--p-jobs", str(args.jobs),
+             "--o-community-list", "community.txt", "--o-profile", "create_profile.json"]
+    if args.threshold:
+        options.append("--p-threshold-mode")
+    if args.block_index:
+        options.append("--p-block-index")
+    disco("create", *options)
+    with open("create_profile.json") as report_file:
+        report=json.load(report_file)
+    with open("community.txt") as community_file:
+        members=[line.rstrip("\n").split("\t") for line in community_file][1:]
+    #equal proportions of the groups in the community
+    groups=sorted(set(member[1] for member in members))
+    with open("proportions.txt", "w") as proportion_file:
+        proportion_file.write("".join("{}\t{}\n".format(group, 1/len(groups)) for group in groups))
+    profile=disco_microbe.Profile()
+    num_taxa=max(1, len(members)//2)
+    if num_taxa < len(members):
+        profile.phase("subsample", num_taxa=num_taxa)
+        disco("subsample", "--i-input-community", "community.txt", "--p-num-taxa", str(num_taxa), "--p-seed", str(args.seed))
+    profile.phase("subsample_proportion", groups=len(groups))
+    disco("subsample", "--i-input-community", "community.txt", "--p-proportion", "proportions.txt", "--p-group-by", "Group", "--p-seed", str(args.seed))
+    profile.end()
+    sys.stdout=stdout
+    return {"sequences": report["sequences"],
+            "pairs_compared": report["distances"]["pairs"] if report["distances"] else None,
+            "community": len(members),
+            "phases": {phase["phase"]: phase["wall_seconds"] for phase in report["phases"]+profile.phases},
+            "cpu_phases": {phase["phase"]: phase["cpu_seconds"] for phase in report["phases"]+profile.phases},
+            "peak_memory_mb": report["peak_memory_mb"],
+            "worker_peak_memory_mb": report["worker_peak_memory_mb"]}
+
+if __name__ == "__main__":
+    main()
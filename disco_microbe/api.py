@@ -0,0 +1,165 @@
+"""Python interface to the create and subsample modules.
+
+The distances of an alignment are calculated once into a DistanceMatrix,
+which builds any number of communities without reading the alignment or
+calculating distances again. Nothing is written to disk unless a database
+or output path is given. Progress messages are only written, to stderr,
+with verbose.
+"""
+import io
+import sys
+import random
+import contextlib
+from collections import defaultdict
+
+from disco_microbe.disco_microbe import (sequenceDictionary, compactAlignment, isBinaryDatabase,
+                                         editDistanceDictionary, readEDdictionary, readDistanceDatabase,
+                                         validateCommunity, restartSeeds, restartCommunities,
+                                         reportRestarts, largestCommunities, straininfo, joinstrain, outputnostrain,
+                                         proportionSubsample, isclose)
+
+class DistanceMatrix:
+    """Neighbour graph of an alignment up to the largest edit distance of interest.
+
+    Communities can be built at any edit distance up to max_edit_distance.
+    The full sequences are kept in sequences for fasta output.
+    """
+
+    def __init__(self, sequences, graph):
+        self.sequences=sequences
+        self.graph=graph
+
+    @classmethod
+    def from_fasta(cls, alignment, max_edit_distance, engine="python", jobs=1, threshold=False, block_index=False,
+                   distance_database=None, update_database=False, database_path=None, database_format="tsv", verbose=False):
+        """Read an alignment, a path or a file opened in binary mode, and calculate its distances.
+
+        Distances already in distance_database are read instead of calculated.
+        A database is only written when database_path is given, or the
+        distance_database is updated in place with update_database.
+        """
+        if max_edit_distance < 1:
+            raise ValueError("max_edit_distance must be at least 1")
+        if block_index and (not threshold or distance_database):
+            raise ValueError("block_index must be used with threshold and without distance_database")
+        if update_database and (threshold or not distance_database):
+            raise ValueError("update_database needs distance_database and can not be used with threshold")
+        with progressMessages(verbose):
+            if isinstance(alignment, str):
+                with open(alignment, "rb") as alignment_file:
+                    sequences=sequenceDictionary(alignment_file)
+            else:
+                sequences=sequenceDictionary(alignment)
+            distance_dict=compactAlignment(sequences)[0]
+            write_database=database_path is not None or update_database
+            if distance_database and isBinaryDatabase(distance_database):
+                graph=readDistanceDatabase(distance_dict, distance_database, max_edit_distance, engine, jobs, threshold,
+                                           update_database, write_database=write_database, output_path=database_path)
+            elif distance_database:
+                graph=readEDdictionary(distance_dict, distance_database, max_edit_distance, engine, jobs, threshold,
+                                       update_database, write_database=write_database, output_path=database_path)
+            else:
+                graph=editDistanceDictionary(distance_dict, max_edit_distance, engine, jobs, threshold, database_format,
+                                             block_index, write_database=write_database, database_path=database_path)
+        return cls(sequences, graph)
+
+    @property
+    def ids(self):
+        return self.graph.ids
+
+    @property
+    def max_edit_distance(self):
+        return self.graph.max_distance
+
+    def __len__(self):
+        return len(self.graph)
+
+    def distance(self, first, second):
+        """Edit distance between two sequences, or None when it is above max_edit_distance."""
+        return self.graph.distance(self.graph.index[first], self.graph.index[second])
+
+    def conflicts(self, include, edit_distance):
+        """Pairs of members of include within edit_distance of each other."""
+        conflicts=validateCommunity(list(include), edit_distance, self.graph)
+        return list(zip(conflicts[::2], conflicts[1::2]))
+
+    def build_community(self, edit_distance, seed=None, include=None, restarts=1, jobs=1, verbose=False):
+        """Members of a community with at least edit_distance differences between every pair.
+
+        The community is the one disco create builds with the same seed and
+        include strains. With restarts the largest of that many seeded
+        communities is returned, built in jobs processes, and verbose reports
+        the size of each. The random module is not reseeded.
+        """
+        if not 1 <= edit_distance <= self.max_edit_distance:
+            raise ValueError("edit_distance must be between 1 and {}".format(self.max_edit_distance))
+        if restarts < 1:
+            raise ValueError("restarts must be at least 1")
+        starter_community=None
+        if include is not None:
+            starter_community=list(include)
+            conflicts=self.conflicts(starter_community, edit_distance)
+            if conflicts:
+                raise ValueError("The included strains are not valid due to the following members: {}".format(
+                    ", ".join("{},{}".format(*pair) for pair in conflicts)))
+        seeds=restartSeeds(seed, restarts)
+        communities=restartCommunities(self.graph, edit_distance, starter_community, seeds, jobs)
+        if restarts > 1:
+            with progressMessages(verbose):
+                reportRestarts(communities)
+        return largestCommunities(communities)[0][1]
+
+    def write_community(self, community, path, metadata=None, community_order=False):
+        """Write a community as disco create does, joined to a metadata file path when given.
+
+        Returns the members without a metadata row.
+        """
+        with open(path, "w") as output:
+            if metadata is None:
+                outputnostrain(output, community)
+                return []
+            with open(metadata) as metadata_file:
+                return joinstrain(straininfo(metadata_file), community, output, community_order)
+
+    def write_fasta(self, community, path):
+        with open(path, "w") as fasta_file:
+            fasta_file.write("".join(">{}\n{}\n".format(sequence_id, self.sequences[sequence_id]) for sequence_id in community))
+
+def progressMessages(verbose):
+    #the modules print their progress, which goes to stderr with verbose and is dropped otherwise
+    return contextlib.redirect_stdout(sys.stderr if verbose else io.StringIO())
+
+def subsample(members, num_taxa=None, seed=None, proportions=None, groups=None, enforce=False):
+    """Subsample a community, by number of members or by proportions of groups.
+
+    members can be identifiers or rows of a community file. With proportions,
+    a mapping of group to proportion, groups gives the group of each member,
+    as a mapping or a function. The members kept are the ones disco subsample
+    keeps with the same seed.
+    """
+    members=list(members)
+    rng=random.Random(seed)
+    if proportions is None:
+        if num_taxa is None or enforce:
+            raise ValueError("Either num_taxa or proportions is required, enforce needs proportions")
+        if not 0 < num_taxa < len(members):
+            raise ValueError("num_taxa must be between 1 and the number of members less one")
+        return rng.sample(members, num_taxa)
+    if groups is None:
+        raise ValueError("groups is required with proportions")
+    if enforce and num_taxa is None:
+        raise ValueError("enforce needs num_taxa")
+    group_of=groups if callable(groups) else groups.__getitem__
+    grouping_dict=defaultdict(list)
+    for member in members:
+        grouping_dict[group_of(member)].append(member)
+    goal_prop={}
+    for group, proportion in proportions.items():
+        if group not in grouping_dict:
+            raise ValueError("{} not found in groups".format(group))
+        if not isclose(0, proportion):
+            goal_prop[group]=proportion
+    if not isclose(1, sum(goal_prop.values())):
+        raise ValueError("Proportions do not sum to 1. Currently sum to {}".format(sum(goal_prop.values())))
+    grouping_dict=proportionSubsample(grouping_dict, goal_prop, num_taxa, enforce, rng)[0]
+    return [member for group in grouping_dict for member in grouping_dict[group]]
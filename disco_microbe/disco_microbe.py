@@ -4,12 +4,18 @@ import os
 import argparse
 import functools
 import operator
-import copy
 import time
-import math
-from itertools import combinations
-from collections import defaultdict
-from Bio import SeqIO
+import ctypes
+import multiprocessing
+import mmap
+import struct
+import gzip
+import io
+import json
+import hashlib
+import sqlite3
+from itertools import islice, chain
+from collections import defaultdict, deque
 from disco_microbe._version import __version__
 
 def main():
@@ -22,20 +28,54 @@ def main():
     #Create subcommand
     parser_create = subparsers.add_parser("create", parents=[parser], help='Module to create highly diverse community at specified edit distance')
     create_required = parser_create.add_argument_group("required named arguments")
-    create_required.add_argument("--i-alignment", type=argparse.FileType("r"), dest="input_alignment", required=True,
-                                 help="Alignment file in fasta form (REQUIRED)")
+    create_required.add_argument("--i-alignment", type=argparse.FileType("rb"), dest="input_alignment", required=True,
+                                 help="Alignment file in fasta form, optionally gzip compressed (REQUIRED)")
     parser_create.add_argument("--i-metadata", type=argparse.FileType("r"), dest="metadata",
                                help="Information to combine with the community output. File must contain a header, be tab-delimited, and contain the identifiers in the first column")
-    parser_create.add_argument("--i-distance-database", type=argparse.FileType("r"), dest="distance_dictionary",
-                               help="Pre-calculated distance database of sequences")
-    create_required.add_argument("--p-editdistance", type=int, dest="edit_value", required=True,
-                                 help="Edit distance value as integer (REQUIRED)")
+    parser_create.add_argument("--i-distance-database", dest="distance_dictionary",
+                               help="Pre-calculated distance database of sequences, either tab-delimited or binary")
+    create_required.add_argument("--p-editdistance", type=editDistanceList, dest="edit_value", required=True,
+                                 help="Edit distance value as integer, or a range such as 1-10 or a comma separated list to build a community for each edit distance (REQUIRED)")
+    parser_create.add_argument("--p-community-order", action="store_true", dest="community_order", default=False,
+                               help="With --i-metadata, write the community in the order members were added instead of the order of the metadata file")
     parser_create.add_argument("--p-include-strains", type=argparse.FileType("r"), dest="starter_community",
                                help="List of strains the final community must include with each identifier on its own line")
     parser_create.add_argument("--o-community-list", type=argparse.FileType("w"), dest="output",
                                help="Output file name")
     parser_create.add_argument("--o-fasta", type=argparse.FileType("w"), dest="output_fasta",
                                help="Output final community sequences in fasta format")
+    parser_create.add_argument("--p-distance-engine", choices=["python", "numpy"], default="python", dest="engine",
+                               help="Engine used to calculate pairwise distances. The numpy engine encodes the alignment once and compares blocks of sequences at a time. Default: python")
+
+    parser_create.add_argument("--p-threshold-mode", action="store_true", dest="threshold", default=False,
+                               help="Only keep pairs within --p-editdistance. Each comparison stops once it is above the edit distance and no distance database is written")
+    parser_create.add_argument("--p-block-index", action="store_true", dest="block_index", default=False,
+                               help="With --p-threshold-mode, only compare pairs of sequences that share a block of identical columns, which every pair within --p-editdistance does")
+    parser_create.add_argument("--p-database-format", choices=["tsv", "binary"], default="tsv", dest="database_format",
+                               help="Format of the distance database written when no --i-distance-database is given. Default: tsv")
+    parser_create.add_argument("--p-jobs", type=int, default=1, dest="jobs",
+                               help="Number of processes used to calculate pairwise distances. Default: 1")
+    parser_create.add_argument("--p-update-database", action="store_true", dest="update_database", default=False,
+                               help="Add the newly calculated distances to --i-distance-database instead of writing a new database")
+    parser_create.add_argument("--p-restarts", type=int, default=1, dest="restarts",
+                               help="Number of seeded community constructions, run in --p-jobs processes, of which the largest community is kept. Default: 1")
+    parser_create.add_argument("--p-keep-communities", type=int, default=1, dest="keep_communities",
+                               help="With --p-restarts, also write the next largest distinct communities to Community_ED<editdistance>_<rank>.txt up to this many communities. Default: 1")
+    parser_create.add_argument("--p-time-limit", type=float, default=0, dest="time_limit",
+                               help="Seconds spent enlarging each community by local search after it is built, with the connected components of sequences within the edit distance searched in --p-jobs processes. Default: 0, no local search")
+
+    parser_create.add_argument("--p-work-dir", dest="work_dir",
+                               help="Directory where blocks of calculated distances are saved as they are completed, so a stopped run can be resumed with --p-resume")
+    parser_create.add_argument("--p-resume", action="store_true", dest="resume", default=False,
+                               help="Resume the distance calculations saved in --p-work-dir by an earlier run of the same alignment and options")
+    parser_create.add_argument("--p-distance-cache", dest="distance_cache",
+                               help="SQLite file of distances kept between runs and alignments. Pairs of sequences found in it are not calculated again and new distances are added to it. Only used by the python engine, the numpy engine calculates distances faster than they are read")
+    parser_create.add_argument("--p-cache-size", type=int, default=1024, dest="cache_size",
+                               help="Size in MB the distance cache is kept under by removing its oldest distances. Default: 1024")
+    parser_create.add_argument("--p-profile", action="store_true", dest="profile", default=False,
+                               help="Report the wall and CPU time of each phase, the progress of the distance calculations and the rate of community construction")
+    parser_create.add_argument("--o-profile", dest="profile_report",
+                               help="Write the --p-profile measurements to this JSON file, implies --p-profile")
 
     parser_create.set_defaults(func=create)
 
@@ -44,9 +84,14 @@ def main():
     subsample_required = parser_subsample.add_argument_group("required named arguments")
     subsample_required.add_argument("--i-input-community", type=argparse.FileType("r"), dest="community", required=True,
                     help="Tab seperated file with taxa ids in the first column with metadata in additional columns, output of create module (REQUIRED)")
-    parser_subsample.add_argument("--p-num-taxa", "-n", type=int, dest="num_taxa",
-                    help="Number of strains desired in final community")
+    parser_subsample.add_argument("--p-num-taxa", "-n", type=taxaNumberList, dest="num_taxa",
+                    help="Number of strains desired in final community. With --p-replicates also a range such as 50-100 or a comma separated list")
     parser_subsample.add_argument("--p-max-communities", action="store_true", dest="max_comm", default=False, help="When used with --p-num-taxa produce maximum number of unique communities with --p-num-taxa strains")
+    parser_subsample.add_argument("--p-replicates", type=int, default=1, dest="replicates",
+                    help="Number of subsamples of each --p-num-taxa, each with its own seed derived from --p-seed. Default: 1")
+    parser_subsample.add_argument("--p-jobs", type=int, default=1, dest="jobs",
+                    help="Number of processes used to draw replicate subsamples. Default: 1")
+    parser_subsample.add_argument("--p-single-output", action="store_true", dest="single_output", default=False, help="With --p-max-communities or --p-replicates write every community to one file with a Partition, or Size and Replicate, column instead of a file for each community")
     parser_subsample.add_argument("--p-group-by", dest="group_by",
                         help="Column name to group-by for proportion calculation. Default to second column")
     parser_subsample.add_argument("--p-proportion", type=argparse.FileType("r"), dest="proportion",
@@ -55,6 +100,43 @@ def main():
     parser_subsample.add_argument("--o-subsample", dest="suboutput", default="Subsampled_community_taxa", help="File name prefix for subsample output file. Default: Subsampled_community_taxa")
     parser_subsample.set_defaults(func=subsample)
 
+    #Convert subcommand
+    parser_convert=subparsers.add_parser("convert", help="Module to convert a distance database between the tab-delimited and binary formats")
+    convert_required = parser_convert.add_argument_group("required named arguments")
+    convert_required.add_argument("--i-distance-database", dest="distance_dictionary", required=True,
+                    help="Distance database to convert, a tab-delimited database becomes binary and a binary database becomes tab-delimited (REQUIRED)")
+    convert_required.add_argument("--o-distance-database", dest="output_database", required=True,
+                    help="Output file name (REQUIRED)")
+    parser_convert.set_defaults(func=convert)
+
+    #Shard subcommand
+    parser_shard=subparsers.add_parser("shard", help="Module to calculate one shard of the pairwise distances of an alignment, to be combined with merge")
+    shard_required = parser_shard.add_argument_group("required named arguments")
+    shard_required.add_argument("--i-alignment", type=argparse.FileType("rb"), dest="input_alignment", required=True,
+                    help="Alignment file in fasta form, optionally gzip compressed, the same for every shard (REQUIRED)")
+    shard_required.add_argument("--p-shard", type=shardSpec, dest="shard", required=True,
+                    help="Shard to calculate as i/k, the ith of k shards (REQUIRED)")
+    shard_required.add_argument("--o-shard", dest="output_shard", required=True,
+                    help="Output file name of the shard (REQUIRED)")
+    parser_shard.add_argument("--p-distance-engine", choices=["python", "numpy"], default="python", dest="engine",
+                    help="Engine used to calculate pairwise distances. Default: python")
+    parser_shard.add_argument("--p-jobs", type=int, default=1, dest="jobs",
+                    help="Number of processes used to calculate pairwise distances. Default: 1")
+    parser_shard.set_defaults(func=shard)
+
+    #Merge subcommand
+    parser_merge=subparsers.add_parser("merge", help="Module to merge every shard of an alignment into a distance database")
+    merge_required = parser_merge.add_argument_group("required named arguments")
+    merge_required.add_argument("--i-alignment", type=argparse.FileType("rb"), dest="input_alignment", required=True,
+                    help="Alignment file the shards were calculated from (REQUIRED)")
+    merge_required.add_argument("--i-shards", nargs="+", dest="shards", required=True,
+                    help="Every shard of the alignment (REQUIRED)")
+    merge_required.add_argument("--o-distance-database", dest="output_database", required=True,
+                    help="Output file name (REQUIRED)")
+    parser_merge.add_argument("--p-database-format", choices=["tsv", "binary"], default="tsv", dest="database_format",
+                    help="Format of the distance database. Default: tsv")
+    parser_merge.set_defaults(func=merge)
+
     # Parse args
     if len(sys.argv) == 1 or sys.argv[1] == "-h" or sys.argv[1] == "--help":
         parser.print_help(sys.stderr)
@@ -63,75 +145,224 @@ def main():
         args = parser.parse_args()
         args.func(args)
 
+def integerList(value, description):
+    #a single integer, a range such as 1-10 or a comma separated list of both
+    values=[]
+    try:
+        for part in value.split(","):
+            if "-" in part:
+                first, last=part.split("-")
+                values.extend(range(int(first), int(last)+1))
+            else:
+                values.append(int(part))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid {}: {}".format(description, value))
+    if not values:
+        raise argparse.ArgumentTypeError("invalid {}: {}".format(description, value))
+    return sorted(set(values))
+
+def editDistanceList(value):
+    return integerList(value, "edit distance")
+
+def taxaNumberList(value):
+    return integerList(value, "number of taxa")
+
 def create(args):
+    if args.jobs < 1:
+        print("ERROR: --p-jobs must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    if args.restarts < 1 or args.keep_communities < 1 or args.keep_communities > args.restarts:
+        print("ERROR: --p-restarts must be at least 1 and --p-keep-communities between 1 and --p-restarts", file=sys.stderr)
+        sys.exit(1)
+    if args.time_limit < 0:
+        print("ERROR: --p-time-limit can not be negative", file=sys.stderr)
+        sys.exit(1)
+    if args.update_database and (args.threshold or not args.distance_dictionary):
+        print("ERROR: --p-update-database needs --i-distance-database and can not be used with --p-threshold-mode", file=sys.stderr)
+        sys.exit(1)
+    if args.block_index and (not args.threshold or args.distance_dictionary):
+        print("ERROR: --p-block-index must be used with --p-threshold-mode and without --i-distance-database", file=sys.stderr)
+        sys.exit(1)
+    if args.resume and not args.work_dir:
+        print("ERROR: --p-resume needs the --p-work-dir of the run to resume", file=sys.stderr)
+        sys.exit(1)
+    if args.distance_cache and args.work_dir:
+        print("ERROR: --p-distance-cache can not be used with --p-work-dir", file=sys.stderr)
+        sys.exit(1)
+    if args.work_dir and (args.distance_dictionary or args.block_index):
+        print("ERROR: --p-work-dir can not be used with --i-distance-database or --p-block-index", file=sys.stderr)
+        sys.exit(1)
+    if len(args.edit_value) > 1 and args.output:
+        print("ERROR: With several edit distances each community is written to Community_ED<editdistance>.txt, --o-community-list can not be used", file=sys.stderr)
+        sys.exit(1)
+    if args.edit_value[0] < 1:
+        print("ERROR:No edit distance given", file=sys.stderr)
+        sys.exit(1)
+    profile=Profile(args.profile or args.profile_report is not None)
+    #the distances are loaded once for the largest edit distance, the neighbour graph answers every smaller one
+    editdistance_value=args.edit_value[-1]
     random.seed(args.seed)
+    cache=None
+    if args.distance_cache and args.engine == "numpy":
+        print("The numpy engine calculates distances faster than they are read from the distance cache, --p-distance-cache is not used")
+    elif args.distance_cache:
+        cache=DistanceCache(args.distance_cache, args.cache_size*2**20)
     if (args.input_alignment):
         if (args.distance_dictionary):
             print("Creating sequence dictionary")
-            sequence_dict=sequenceDictionary(args.input_alignment)
-            print("Creating distance dictionary by performing {} calculations".format(math.factorial(len(sequence_dict))/(2*math.factorial(len(sequence_dict)-2))))
-            dict_ed=readEDdictionary(sequence_dict,args.distance_dictionary)
-            duplist=duplicatelist(dict_ed)
-            print("The input has {} unique sequences".format((len(dict_ed)-len(duplist))))
+            profile.phase("load")
+            try:
+                sequence_dict=sequenceDictionary(args.input_alignment)
+            except ValueError as error:
+                print("ERROR: {}".format(error), file=sys.stderr)
+                sys.exit(1)
+            #the full sequences are kept for the fasta output
+            distance_dict,alignment_length,compacted_length=compactAlignment(sequence_dict)
+            print("Compacted the alignment from {} to {} columns".format(alignment_length, compacted_length))
+            profile.phase("distances")
+            digests=sequenceDigests(sequence_dict) if cache else None
+            if isBinaryDatabase(args.distance_dictionary):
+                graph=readDistanceDatabase(distance_dict,args.distance_dictionary,editdistance_value,args.engine,args.jobs,args.threshold,args.update_database,progress=profile,cache=cache,digests=digests)
+            else:
+                graph=readEDdictionary(distance_dict,args.distance_dictionary,editdistance_value,args.engine,args.jobs,args.threshold,args.update_database,progress=profile,cache=cache,digests=digests)
+            duplist=duplicatelist(graph)
+            print("The input has {} unique sequences".format((len(graph)-len(duplist))))
+            print("The neighbour graph holds {} pairs within edit distance {} ({:.1f} MB)".format(graph.pair_count, editdistance_value, graph.nbytes/2**20))
         else:
             print("Creating sequence dictionary")
-            sequence_dict=sequenceDictionary(args.input_alignment)
-            print("Creating distance dictionary by performing {} calculations".format(math.factorial(len(sequence_dict))/(2*math.factorial(len(sequence_dict)-2))))
-            dict_ed=editDistanceDictionary(sequence_dict)
-            duplist=duplicatelist(dict_ed)
-            print("The input has {} unique sequences".format((len(dict_ed)-len(duplist))))
+            profile.phase("load")
+            try:
+                sequence_dict=sequenceDictionary(args.input_alignment)
+            except ValueError as error:
+                print("ERROR: {}".format(error), file=sys.stderr)
+                sys.exit(1)
+            #the full sequences are kept for the fasta output
+            distance_dict,alignment_length,compacted_length=compactAlignment(sequence_dict)
+            print("Compacted the alignment from {} to {} columns".format(alignment_length, compacted_length))
+            profile.phase("distances")
+            digests=sequenceDigests(sequence_dict) if cache else None
+            try:
+                graph=editDistanceDictionary(distance_dict,editdistance_value,args.engine,args.jobs,args.threshold,args.database_format,args.block_index,
+                                             progress=profile,work_dir=args.work_dir,resume=args.resume,cache=cache,digests=digests)
+            except ValueError as error:
+                print("ERROR: {}".format(error), file=sys.stderr)
+                sys.exit(1)
+            duplist=duplicatelist(graph)
+            print("The input has {} unique sequences".format((len(graph)-len(duplist))))
+            print("The neighbour graph holds {} pairs within edit distance {} ({:.1f} MB)".format(graph.pair_count, editdistance_value, graph.nbytes/2**20))
     else:
         print("ERROR:No input file", file=sys.stderr)
         sys.exit(1)
-    if (args.edit_value):
-        if (args.starter_community):
-            starter_community=startcommunity(args.starter_community)
-            community_validity=validateCommunity(starter_community,args.edit_value,dict_ed)
+    if cache is not None:
+        cache.close()
+        print("{} pairs were found in the distance cache and {} were added to it".format(cache.hits, cache.added))
+    starter_community=startcommunity(args.starter_community) if args.starter_community else None
+    if (args.metadata):
+        strain_info=straininfo(args.metadata)
+    community_sizes=[]
+    for editdistance_value in args.edit_value:
+        profile.phase("community", editdistance=editdistance_value)
+        if len(args.edit_value) > 1:
+            print("Building community at edit distance {}".format(editdistance_value))
+            #each edit distance starts from the seed so its community is the one a single run would build
+            random.seed(args.seed)
+        if starter_community is not None:
+            community_validity=validateCommunity(starter_community,editdistance_value,graph)
             if community_validity:
                 print("Community is not valid due to the following members:")
                 it = iter(community_validity)
                 for x in it:
                     print ("{},{}".format(x, next(it)))
-                sys.exit(1)
+                if len(args.edit_value) == 1:
+                    sys.exit(1)
+                community_sizes.append((editdistance_value, "NA"))
+                continue
             else:
                 print("Community is valid")
-                community=[]
-                community=starter_community
-                print("Starting community with:{}".format(community))
-                community=loopforCommunity(community,args.edit_value,dict_ed)
-                print("The number of community members is {}".format(len(community)))
-        else:
-            community=withoutcommunityinput(dict_ed,args.edit_value)
+        if args.restarts > 1:
+            seeds=restartSeeds(args.seed,args.restarts)
+            print("Building {} communities".format(args.restarts))
+            communities=restartCommunities(graph,editdistance_value,starter_community,seeds,args.jobs)
+            reportRestarts(communities)
+            best_communities=largestCommunities(communities,args.keep_communities)
+            restart,community=best_communities[0]
+            print("Keeping the community of restart {} with {} members{}".format(restart+1, len(community), restartSeed(seeds[restart])))
+        elif starter_community is not None:
+            community=[]
+            community=list(starter_community)
             print("Starting community with:{}".format(community))
-            community=loopforCommunity(community,args.edit_value,dict_ed)
+            community=loopforCommunity(community,editdistance_value,graph)
             print("The number of community members is {}".format(len(community)))
-    else:
-        print("ERROR:No edit distance given", file=sys.stderr)
-        sys.exit(1)
-    if (args.metadata):
-        strain_info,metadata_header=straininfo(args.metadata)
-        if (args.output):
-            print("Joining information")
-            print("Writing output file")
-            joinstrain(strain_info,community,args.output,metadata_header)
         else:
-            print("Creating output file")
-            outputfile=outfile(args.edit_value)
-            print("Joining information")
-            joinstrain(strain_info,community,outputfile,metadata_header)
-    else:
-        if (args.output):
-            print("Writing output file")
-            outputnostrain(args.output,community)
+            community=withoutcommunityinput(graph,editdistance_value)
+            print("Starting community with:{}".format(community))
+            community=loopforCommunity(community,editdistance_value,graph)
+            print("The number of community members is {}".format(len(community)))
+        #each greedy iteration places one member, with restarts in every community built
+        placed=sum(len(built) for built in communities) if args.restarts > 1 else len(community)
+        profile.end(iterations=placed-len(starter_community or [])*args.restarts)
+        if args.time_limit:
+            profile.phase("local search", editdistance=editdistance_value)
+            greedy_size=len(community)
+            community=improveCommunity(graph,editdistance_value,community,starter_community,args.time_limit,args.jobs,args.seed)
+            community_validity=validateCommunity(community,editdistance_value,graph)
+            if community_validity:
+                print("ERROR: The community of the local search is not valid due to the following members: {}".format(", ".join(community_validity)), file=sys.stderr)
+                sys.exit(1)
+            print("Local search grew the community from {} to {} members".format(greedy_size, len(community)))
+            profile.end(members_added=len(community)-greedy_size)
+        profile.phase("output", editdistance=editdistance_value)
+        community_sizes.append((editdistance_value, len(community)))
+        if (args.metadata):
+            if (args.output):
+                print("Joining information")
+                print("Writing output file")
+                reportMissingMetadata(joinstrain(strain_info,community,args.output,args.community_order))
+            else:
+                print("Creating output file")
+                with outfile(editdistance_value) as outputfile:
+                    print("Joining information")
+                    reportMissingMetadata(joinstrain(strain_info,community,outputfile,args.community_order))
         else:
-            print("Creating output file")
-            outputfile=outfile(args.edit_value)
-            print("Writing output file")
-            outputnostrain(outputfile,community)
-    if (args.output_fasta):
-        outputfasta(sequence_dict,community,args.edit_value)
+            if (args.output):
+                print("Writing output file")
+                outputnostrain(args.output,community)
+            else:
+                print("Creating output file")
+                with outfile(editdistance_value) as outputfile:
+                    print("Writing output file")
+                    outputnostrain(outputfile,community)
+        if args.restarts > 1:
+            for rank, (restart, ranked_community) in enumerate(best_communities[1:], 2):
+                print("Writing community {} of restart {} with {} members{}".format(rank, restart+1, len(ranked_community), restartSeed(seeds[restart])))
+                with open('Community_ED{}_{}.txt'.format(editdistance_value, rank), "w+") as outputfile:
+                    if (args.metadata):
+                        reportMissingMetadata(joinstrain(strain_info,ranked_community,outputfile,args.community_order))
+                    else:
+                        outputnostrain(outputfile,ranked_community)
+        if (args.output_fasta):
+            outputfasta(sequence_dict,community,editdistance_value)
+    if len(args.edit_value) > 1:
+        print("Writing community size summary")
+        with open('Community_ED_summary.txt', "w+") as summary_file:
+            summary_file.write("EditDistance\tMembers\n")
+            for editdistance_value, size in community_sizes:
+                print("{}\t{}".format(editdistance_value, size))
+                summary_file.write("{}\t{}\n".format(editdistance_value, size))
+    profile.end()
+    memory, worker_memory=peakMemory()
+    if memory is not None and args.jobs > 1:
+        print("Peak memory usage: {:.1f} MB (largest worker process: {:.1f} MB)".format(memory, worker_memory))
+    elif memory is not None:
+        print("Peak memory usage: {:.1f} MB".format(memory))
+    if args.profile_report:
+        profile.report(args.profile_report, sequences=len(sequence_dict), edit_distances=args.edit_value, engine=args.engine, jobs=args.jobs,
+                       peak_memory_mb=memory, worker_peak_memory_mb=worker_memory)
+        print("Profile written to {}".format(args.profile_report))
 
 def subsample(args):
+    taxa_sizes = args.num_taxa or []
+    replicate_mode = args.replicates > 1 or len(taxa_sizes) > 1
     if args.num_enforce and not args.proportion:
         print("ERROR: The --taxa-num-enforce option must be used with the --proportion option", file=sys.stderr)
         sys.exit(1)
@@ -147,34 +378,50 @@ def subsample(args):
     elif args.max_comm and args.proportion:
         print("ERROR: The --p-max-communities can not be used with the --p-proportion option", file=sys.stderr)
         sys.exit(1)
+    elif args.replicates < 1 or args.jobs < 1:
+        print("ERROR: --p-replicates and --p-jobs must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    elif replicate_mode and (args.max_comm or args.proportion or not args.num_taxa):
+        print("ERROR: The --p-replicates option and several --p-num-taxa values need --p-num-taxa and can not be used with --p-max-communities or --p-proportion", file=sys.stderr)
+        sys.exit(1)
+    elif args.single_output and not (args.max_comm or replicate_mode):
+        print("ERROR: The --p-single-output option must be used with the --p-max-communities or --p-replicates option", file=sys.stderr)
+        sys.exit(1)
+    num_taxa = taxa_sizes[-1] if taxa_sizes else None
 
     random.seed(args.seed)
     community_list = [line.strip().split("\t") for line in args.community]
     header = community_list[0]
     community_list = community_list[1:]
     #Check to see num_taxa great or equal to current community size
-    if args.num_taxa and len(community_list) <= args.num_taxa:
+    if num_taxa and len(community_list) <= num_taxa:
         print("ERROR: --num-taxa >= current community taxa count", file=sys.stderr)
         sys.exit(1)
 
-    if args.num_taxa and not args.proportion:
+    if replicate_mode:
+        replicateSubsamples(community_list, header, taxa_sizes, restartSeeds(args.seed, args.replicates), args.suboutput, args.single_output, args.jobs)
+
+    elif num_taxa and not args.proportion:
         if args.max_comm:
-            comm_count = 1
-            while True:
-                new_community = random.sample(community_list, args.num_taxa)
-                with open("{}{}_{}.txt".format(args.suboutput, args.num_taxa, comm_count), "w") as subsample_output:
-                    print("\t".join(header), file=subsample_output)
-                    for member in new_community:
-                        print("{}".format("\t".join(member)), file=subsample_output)
-                if len(community_list) - args.num_taxa < args.num_taxa:
-                    break
-                else:
-                    comm_count += 1
-                    for member in new_community:
-                        community_list.remove(member)
+            #one shuffle, then consecutive slices of num_taxa are disjoint random communities
+            random.shuffle(community_list)
+            comm_total = len(community_list)//num_taxa
+            if args.single_output:
+                with open("{}{}_communities.txt".format(args.suboutput, num_taxa), "w") as subsample_output:
+                    subsample_output.write("{}\tPartition\n".format("\t".join(header)))
+                    for comm_count in range(1, comm_total + 1):
+                        new_community = community_list[(comm_count - 1)*num_taxa:comm_count*num_taxa]
+                        subsample_output.write("".join("{}\t{}\n".format("\t".join(member), comm_count) for member in new_community))
+            else:
+                for comm_count in range(1, comm_total + 1):
+                    new_community = community_list[(comm_count - 1)*num_taxa:comm_count*num_taxa]
+                    with open("{}{}_{}.txt".format(args.suboutput, num_taxa, comm_count), "w") as subsample_output:
+                        subsample_output.write("{}\n".format("\t".join(header)))
+                        subsample_output.write("".join("{}\n".format("\t".join(member)) for member in new_community))
+            print("Wrote {} communities of {} taxa".format(comm_total, num_taxa))
         else:
-            with open("{}{}.txt".format(args.suboutput, args.num_taxa), "w") as subsample_output:
-                new_community = random.sample(community_list, args.num_taxa)
+            with open("{}{}.txt".format(args.suboutput, num_taxa), "w") as subsample_output:
+                new_community = random.sample(community_list, num_taxa)
                 print("\t".join(header), file=subsample_output)
                 for member in new_community:
                     print("{}".format("\t".join(member)), file=subsample_output)
@@ -208,63 +455,7 @@ def subsample(args):
             print("ERROR: Proportions do not sum to 1. Currently sum to {}".format(sum(goal_prop.values())), file=sys.stderr)
             sys.exit(1)
 
-        grouping_dict = {k: grouping_dict[k] for k in goal_prop}
-        #shuffle taxa
-        for group in grouping_dict:
-            random.shuffle(grouping_dict[group])
-        current_total = sum(len(lst) for lst in grouping_dict.values())
-        current_props = {k: len(grouping_dict[k])/current_total for k in grouping_dict}
-        current_sse = 0
-        error_dict = defaultdict(float)
-        for group in current_props:
-            error_dict[group] = current_props[group] - goal_prop[group]
-            current_sse += (current_props[group] - goal_prop[group])**2
-
-        #loop to minimize sum of squared "errors"
-        while True:
-            #find group with maximum difference to goal proportion
-            max_error = max(error_dict.items(), key=operator.itemgetter(1))
-            #if max diffrence is zero or negative can not improve and break
-            #or if max_error group only has one member.
-            if max_error[1] < 0 or len(grouping_dict[max_error[0]]) == 1:
-                break
-            #if args.num_enforce break early if below args.num_taxa
-            if args.num_enforce and (current_total - 1) < args.num_taxa:
-                break
-            #Remove taxa from group with max error
-            test_grouping_dict = {}
-            for group in grouping_dict:
-                if group == max_error[0]:
-                    temp_list = copy.deepcopy(grouping_dict[group])
-                    temp_list.pop()
-                    random.shuffle(temp_list)
-                    test_grouping_dict[group] = copy.deepcopy(temp_list)
-                else:
-                    test_grouping_dict[group] = copy.deepcopy(grouping_dict[group])
-            #Recalculate SSE
-            temp_total = current_total - 1
-            temp_props = {k: len(test_grouping_dict[k])/temp_total for k in test_grouping_dict}
-            temp_sse = 0
-            temp_error_dict = defaultdict(list)
-            for group in temp_props:
-                temp_error_dict[group] = temp_props[group] - goal_prop[group]
-                temp_sse += (temp_props[group] - goal_prop[group])**2
-            #Test if new SSE is less then current and proceed accordingly
-            if temp_sse < current_sse:
-                current_total -= 1
-                current_props = temp_props.copy()
-                current_sse = temp_sse
-                error_dict = temp_error_dict.copy()
-                grouping_dict[max_error[0]] = copy.deepcopy(test_grouping_dict[max_error[0]])
-            #if num_taxa continue even if temp_sse >= current_sse
-            elif args.num_taxa and current_total > args.num_taxa:
-                current_total -= 1
-                current_props = temp_props.copy()
-                current_sse = temp_sse
-                error_dict = temp_error_dict.copy()
-                grouping_dict[max_error[0]] = copy.deepcopy(test_grouping_dict[max_error[0]])
-            else:
-                break
+        grouping_dict, current_total, current_props = proportionSubsample(grouping_dict, goal_prop, num_taxa, args.num_enforce)
 
         print("Final taxa count: {}".format(current_total))
         print("Actualized proportions")
@@ -276,10 +467,89 @@ def subsample(args):
                 for taxa in grouping_dict[group]:
                     print("{}".format("\t".join(taxa)), file=subsample_output)
 
+def convert(args):
+    if isBinaryDatabase(args.distance_dictionary):
+        print("Converting binary distance database to tab-delimited")
+        sequence_count=binaryToTsv(args.distance_dictionary, args.output_database)
+    else:
+        print("Converting tab-delimited distance database to binary")
+        sequence_count=tsvToBinary(args.distance_dictionary, args.output_database)
+    print("The distance database has {} sequences".format(sequence_count))
+
+def shardSpec(value):
+    #a shard given as i/k, the ith of k shards
+    try:
+        shard_number, shard_count=(int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid shard: {}, give it as i/k".format(value))
+    if not 1 <= shard_number <= shard_count:
+        raise argparse.ArgumentTypeError("invalid shard: {}, i must be between 1 and k".format(value))
+    return shard_number, shard_count
+
+def readAlignment(input_alignment):
+    #the compacted alignment used for distances
+    print("Creating sequence dictionary")
+    try:
+        sequence_dict=sequenceDictionary(input_alignment)
+    except ValueError as error:
+        print("ERROR: {}".format(error), file=sys.stderr)
+        sys.exit(1)
+    distance_dict,alignment_length,compacted_length=compactAlignment(sequence_dict)
+    print("Compacted the alignment from {} to {} columns".format(alignment_length, compacted_length))
+    return distance_dict
+
+def shard(args):
+    if args.jobs < 1:
+        print("ERROR: --p-jobs must be at least 1", file=sys.stderr)
+        sys.exit(1)
+    distance_dict=readAlignment(args.input_alignment)
+    info=writeShard(distance_dict, args.shard[0], args.shard[1], args.output_shard, args.engine, args.jobs)
+    print("Shard {} of {} holds rows {} to {} of {} distinct sequences, {} pairs".format(info["shard"], info["shards"], info["start"], info["stop"], info["sequences"], info["pairs"]))
+
+def merge(args):
+    distance_dict=readAlignment(args.input_alignment)
+    try:
+        shard_count=mergeShards(distance_dict, args.shards, args.output_database, args.database_format)
+    except ValueError as error:
+        print("ERROR: {}".format(error), file=sys.stderr)
+        sys.exit(1)
+    print("Merged {} shards into {}".format(shard_count, args.output_database))
+
+def openAlignment(input_alignment):
+    #gzip compressed alignments are recognised by their magic number
+    if input_alignment.peek(2)[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=input_alignment, mode="rb")
+    return input_alignment
+
+def readFasta(input_alignment):
+    #yields the identifier (the header up to the first whitespace) and sequence of each record
+    #from a fasta file opened in binary mode, lines before the first header are ignored
+    identifier=None
+    lines=[]
+    for line in input_alignment:
+        if line.startswith(b">"):
+            if identifier is not None:
+                yield identifier, b"".join(lines)
+            fields=line[1:].split(None, 1)
+            identifier=fields[0].decode("utf-8") if fields else ""
+            lines=[]
+        elif identifier is not None:
+            lines.append(line.translate(None, b" \t\r\n"))
+    if identifier is not None:
+        yield identifier, b"".join(lines)
+
 def sequenceDictionary(input_alignment):
     sequence_dict={}
-    for record in SeqIO.parse(input_alignment, "fasta"):
-        sequence_dict[record.id]=str(record.seq).upper()
+    alignment_length=None
+    for identifier, sequence in readFasta(openAlignment(input_alignment)):
+        if alignment_length is None:
+            alignment_length=len(sequence)
+        elif len(sequence) != alignment_length:
+            raise ValueError("The sequences are not aligned, {} has {} characters instead of {}".format(identifier, len(sequence), alignment_length))
+        try:
+            sequence_dict[identifier]=sequence.upper().decode("ascii")
+        except UnicodeDecodeError:
+            raise ValueError("{} contains characters that are not nucleotide codes".format(identifier))
     return sequence_dict
 
 nucleiccodedicitonary={"N":set(["A","G","C","T","U"]),
@@ -296,7 +566,6 @@ nucleiccodedicitonary={"N":set(["A","G","C","T","U"]),
 
 standardcode=["A","C","G","T","U","-"]
 
-@functools.lru_cache(maxsize=100000)
 def customeditdistance(seq1,seq2):
     edvalue=0
     for char1, char2 in zip(seq1,seq2):
@@ -328,57 +597,1319 @@ def customeditdistance(seq1,seq2):
                             edvalue+=1
     return edvalue
 
-timestr = time.strftime("%Y%m%d-%H%M%S")
+#distance between two characters, the few pairs of codes are remembered
+characterdistance=functools.lru_cache(maxsize=None)(customeditdistance)
+
+def boundededitdistance(seq1,seq2,limit):
+    #same rules as customeditdistance but stops once the distance is above limit
+    edvalue=0
+    for char1, char2 in zip(seq1,seq2):
+        if char1!=char2 and characterdistance(char1,char2):
+            edvalue+=1
+            if edvalue>limit:
+                break
+    return edvalue
+
+#IUPAC codes as bitmasks, gaps are 0 and never count as a difference
+iupacbitmask={"A":1,"C":2,"G":4,"T":8,"U":16,"-":0}
+for code in nucleiccodedicitonary:
+    iupacbitmask[code]=functools.reduce(operator.or_, (iupacbitmask[base] for base in nucleiccodedicitonary[code]))
 
+#translation table from characters to bitmasks, 255 marks characters without a code
+iupaclookup=bytes(iupacbitmask.get(chr(character), 255) for character in range(256))
 
-def editDistanceDictionary(sequence_dict):
-    dict_ed = defaultdict(lambda: defaultdict(list))
-    with open('distance_dictionary_{}.txt'.format(timestr),"w+") as dictionary_file:
-        for taxa in combinations(sequence_dict.keys(), 2):
-            edvalue=customeditdistance(sequence_dict[taxa[0]], sequence_dict[taxa[1]])
-            dict_ed[taxa[0]][edvalue].append(taxa[1])
-            dict_ed[taxa[1]][edvalue].append(taxa[0])
-            dictionary_file.write("{}\t{}\t{}\n".format(taxa[0],taxa[1],edvalue))
-    return dict_ed
+blockbytes=2**26 #memory budget in bytes for each block of numpy comparisons
 
-def readEDdictionary(sequence_dict,input_ed_dict):
-    dict_ed = defaultdict(lambda: defaultdict(list))
-    comparisons_dict=defaultdict(list)
-    with open('distance_dictionary_{}.txt'.format(timestr),"w+") as dictionary_file:
-        for line in input_ed_dict:
-            line=line.strip()
-            dictionary_file.write("{}\n".format(line))
-            fields= line.split("\t")
-            dict_ed[fields[0]][fields[2]].append(fields[1])
-            dict_ed[fields[1]][fields[2]].append(fields[0])
-            comparisons_dict[fields[0]].append(fields[1])
-            comparisons_dict[fields[1]].append(fields[0])
-    for keys in combinations(sequence_dict.keys(), 2):
-        if comparisons_dict:
-            if keys[1] in comparisons_dict[keys[0]]:
-                pass
+def encodeAlignment(sequence_dict):
+    #shorter sequences are padded with gaps which matches zip in customeditdistance
+    import numpy as np
+    length=max((len(seq) for seq in sequence_dict.values()), default=0)
+    encoded=np.zeros((len(sequence_dict), length), dtype=np.uint8)
+    for row, seq in enumerate(sequence_dict.values()):
+        encoded[row, :len(seq)]=np.frombuffer(seq.encode("ascii").translate(iupaclookup), dtype=np.uint8)
+    if (encoded == 255).any():
+        unknown=set("".join(sequence_dict.values())).difference(iupacbitmask)
+        raise ValueError("Alignment contains characters that are not IUPAC nucleotide codes: {}".format(",".join(sorted(unknown))))
+    return encoded
+
+def numpyDistanceRows(encoded, start, stop):
+    #distances of rows start to stop against every row after start
+    import numpy as np
+    rows=encoded[start:stop, None, :]
+    columns=encoded[None, start+1:, :]
+    mismatch=np.bitwise_and(rows, columns) == 0
+    mismatch&=rows != 0
+    mismatch&=columns != 0
+    return np.count_nonzero(mismatch, axis=2)
+
+def numpyNeighbourRows(encoded, start, stop, limit, width=64):
+    #pairs of rows start to stop with every later row that are within limit,
+    #columns are compared width at a time and pairs above limit are dropped
+    import numpy as np
+    sequence_count, length=encoded.shape
+    counts=sequence_count-1-np.arange(start, stop)
+    rows=np.repeat(np.arange(start, stop), counts)
+    columns=np.arange(rows.size)-np.repeat(np.cumsum(counts)-counts, counts)+rows+1
+    distances=np.zeros(rows.size, dtype=np.int64)
+    for column_start in range(0, length, width):
+        if not rows.size:
+            break
+        seq1=encoded[rows, column_start:column_start+width]
+        seq2=encoded[columns, column_start:column_start+width]
+        mismatch=np.bitwise_and(seq1, seq2) == 0
+        mismatch&=seq1 != 0
+        mismatch&=seq2 != 0
+        distances+=np.count_nonzero(mismatch, axis=1)
+        within=distances <= limit
+        if not within.all():
+            rows, columns, distances=rows[within], columns[within], distances[within]
+    return rows, columns, distances
+
+def contributingColumns(alignment):
+    #columns of a raw character matrix where two sequences can be at a distance, that is
+    #columns holding two non-gap codes without a nucleotide in common, or a character that is not a code
+    import numpy as np
+    masks=np.frombuffer(iupaclookup, dtype=np.uint8)[alignment]
+    present=np.zeros((alignment.shape[1], 256), dtype=bool)
+    for row in range(len(masks)):
+        present[np.arange(alignment.shape[1]), masks[row]]=1
+    codes=np.arange(256)
+    disjoint=((codes[:, None] & codes[None, :]) == 0) & (codes[:, None] != 0) & (codes[None, :] != 0)
+    disjoint[255, :]=True
+    disjoint[:, 255]=True
+    #a column contributes when one of its codes has a disjoint code in the same column
+    partners=(present.astype(np.int64) @ disjoint.astype(np.int64)) > 0
+    return np.flatnonzero((partners & present).any(axis=1))
+
+def compactAlignment(sequence_dict):
+    """Drop the alignment columns that add nothing to any distance.
+
+    Columns that are all gaps, identical in every sequence or only hold codes
+    sharing a nucleotide never add to customeditdistance, so distances between
+    the compacted sequences are the same. Returns the compacted sequences with
+    the original and compacted alignment lengths.
+    """
+    import numpy as np
+    alignment=alignmentMatrix(sequence_dict, "python")
+    columns=contributingColumns(alignment)
+    compacted=np.ascontiguousarray(alignment[:, columns])
+    compact_dict={taxa: compacted[row].tobytes().decode("ascii") for row, taxa in enumerate(sequence_dict)}
+    return compact_dict, alignment.shape[1], len(columns)
+
+def alignmentMatrix(sequence_dict, engine="python"):
+    import numpy as np
+    if engine == "numpy":
+        return encodeAlignment(sequence_dict)
+    #raw characters padded with gaps for the python engine
+    length=max((len(seq) for seq in sequence_dict.values()), default=0)
+    alignment=np.full((len(sequence_dict), length), ord("-"), dtype=np.uint8)
+    for row, seq in enumerate(sequence_dict.values()):
+        alignment[row, :len(seq)]=np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+    return alignment
+
+def tileDistances(alignment, engine, start, stop, limit=None):
+    #yields each row from start to stop with the later rows it was compared to and their distances,
+    #with a limit only the later rows within limit are kept
+    import numpy as np
+    sequence_count, length=alignment.shape
+    if engine == "numpy" and limit is not None:
+        step=max(1, blockbytes//max(1, 64*(sequence_count-start)))
+        for blockstart in range(start, stop, step):
+            blockstop=min(blockstart+step, stop)
+            rows, columns, distances=numpyNeighbourRows(alignment, blockstart, blockstop, limit)
+            bounds=np.searchsorted(rows, np.arange(blockstart, blockstop+1))
+            for row in range(blockstart, blockstop):
+                row_slice=slice(bounds[row-blockstart], bounds[row-blockstart+1])
+                yield row, columns[row_slice], distances[row_slice]
+    elif engine == "numpy":
+        step=max(1, blockbytes//max(1, alignment.size))
+        for blockstart in range(start, stop, step):
+            blockstop=min(blockstart+step, stop)
+            block=numpyDistanceRows(alignment, blockstart, blockstop)
+            for row in range(blockstart, blockstop):
+                yield row, np.arange(row+1, sequence_count), block[row-blockstart, row-blockstart:]
+    else:
+        sequences=[seq.tobytes().decode("ascii") for seq in alignment[start:]]
+        for row in range(start, stop):
+            seq1=sequences[row-start]
+            if limit is None:
+                yield row, np.arange(row+1, sequence_count), np.array([customeditdistance(seq1, seq2) for seq2 in sequences[row-start+1:]], dtype=np.int64)
             else:
-                edvalue=customeditdistance(sequence_dict[keys[0]],sequence_dict[keys[1]])
-                dict_ed[keys[0]][edvalue].append(keys[1])
-                dict_ed[keys[1]][edvalue].append(keys[0])
-                dictionary_file.write("{}\t{}\t{}\n".format(keys[0],keys[1],edvalue))
+                columns=[]
+                distances=[]
+                for column in range(row+1, sequence_count):
+                    edvalue=boundededitdistance(seq1, sequences[column-start], limit)
+                    if edvalue <= limit:
+                        columns.append(column)
+                        distances.append(edvalue)
+                yield row, np.array(columns, dtype=np.int64), np.array(distances, dtype=np.int64)
+
+def rowDistances(alignment, engine, row, columns, limit=None):
+    #distances from row to each of columns, with a limit distances above it are only known to be larger than limit
+    import numpy as np
+    if engine == "numpy":
+        step=max(1, blockbytes//max(1, alignment.shape[1]))
+        seq1=alignment[row]
+        distances=[]
+        for start in range(0, len(columns), step):
+            seq2=alignment[columns[start:start+step]]
+            mismatch=np.bitwise_and(seq1, seq2) == 0
+            mismatch&=seq1 != 0
+            mismatch&=seq2 != 0
+            distances.append(np.count_nonzero(mismatch, axis=1))
+        return np.concatenate(distances) if distances else np.zeros(0, dtype=np.int64)
+    seq1=alignment[row].tobytes().decode("ascii")
+    if limit is None:
+        return np.array([customeditdistance(seq1, alignment[column].tobytes().decode("ascii")) for column in columns.tolist()], dtype=np.int64)
+    return np.array([boundededitdistance(seq1, alignment[column].tobytes().decode("ascii"), limit) for column in columns.tolist()], dtype=np.int64)
+
+def chunkDistances(alignment, engine, rows, limit=None):
+    #distances for a list of (row, columns), the numpy engine compares all pairs of the list together
+    #so rows with few columns do not each pay for a separate comparison
+    import numpy as np
+    if engine != "numpy":
+        return [(row, columns, rowDistances(alignment, engine, row, columns, limit)) for row, columns in rows]
+    counts=[len(columns) for row, columns in rows]
+    firsts=np.repeat([row for row, columns in rows], counts)
+    seconds=np.concatenate([columns for row, columns in rows]) if rows else np.zeros(0, dtype=np.int64)
+    step=max(1, blockbytes//max(1, alignment.shape[1]))
+    distances=np.zeros(len(firsts), dtype=np.int64)
+    for start in range(0, len(firsts), step):
+        seq1=alignment[firsts[start:start+step]]
+        seq2=alignment[seconds[start:start+step]]
+        mismatch=np.bitwise_and(seq1, seq2) == 0
+        mismatch&=seq1 != 0
+        mismatch&=seq2 != 0
+        distances[start:start+step]=np.count_nonzero(mismatch, axis=1)
+    return [(row, columns, row_distances) for (row, columns), row_distances in zip(rows, np.split(distances, np.cumsum(counts)[:-1]))]
+
+def pairTiles(sequence_count, tile_count, first=0, last=None):
+    #split the rows first to last of the upper triangle into row ranges with roughly equal numbers of pairs
+    last=sequence_count if last is None else last
+    total_pairs=sum(range(sequence_count-last, sequence_count-first))
+    target=max(1, -(-total_pairs//max(1, tile_count)))
+    tiles=[]
+    start=first
+    pairs=0
+    for row in range(first, last):
+        pairs+=sequence_count-1-row
+        if pairs >= target:
+            tiles.append((start, row+1))
+            start=row+1
+            pairs=0
+    if start < last:
+        tiles.append((start, last))
+    return tiles
+
+workeralignment=None
+workerengine=None
+
+def initDistanceWorker(shared_alignment, shape, engine):
+    #workers view the parent's shared memory rather than receiving a copy
+    import numpy as np
+    global workeralignment, workerengine
+    #the shared array is never empty, so only the bytes of the alignment are viewed
+    workeralignment=np.frombuffer(shared_alignment, dtype=np.uint8, count=int(np.prod(shape))).reshape(shape)
+    workerengine=engine
+
+def workerTileDistances(tile):
+    return list(tileDistances(workeralignment, workerengine, *tile))
+
+def workerRowDistances(work):
+    rows, limit=work
+    return chunkDistances(workeralignment, workerengine, rows, limit)
+
+def distanceWorkers(alignment, engine, jobs):
+    import numpy as np
+    shared_alignment=multiprocessing.RawArray(ctypes.c_uint8, max(1, alignment.size))
+    np.frombuffer(shared_alignment, dtype=np.uint8)[:alignment.size]=alignment.ravel()
+    return multiprocessing.Pool(jobs, initializer=initDistanceWorker, initargs=(shared_alignment, alignment.shape, engine))
+
+def orderedResults(pool, func, items, inflight):
+    #like pool.imap but keeps at most inflight results waiting in memory
+    pending=deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= inflight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def pairwiseDistanceRows(sequence_dict, engine="python", jobs=1, limit=None):
+    #yields every row with the later rows and their distances, or only the later rows within limit
+    sequence_count=len(sequence_dict)
+    alignment=alignmentMatrix(sequence_dict, engine)
+    #an alignment left without columns has nothing to share with workers
+    if jobs > 1 and alignment.size:
+        tiles=[(start, stop, limit) for start, stop in pairTiles(sequence_count, jobs*4)]
+        with distanceWorkers(alignment, engine, jobs) as pool:
+            for rows in orderedResults(pool, workerTileDistances, tiles, jobs*2):
+                yield from rows
+    else:
+        yield from tileDistances(alignment, engine, 0, sequence_count, limit)
+
+checkpointpairs=5000000 #pairs in each checkpointed block of rows
+
+def alignmentFingerprint(sequence_dict):
+    digest=hashlib.sha256()
+    for taxa, seq in sequence_dict.items():
+        digest.update("{}\t{}\n".format(taxa, seq).encode("utf-8"))
+    return digest.hexdigest()
+
+def syncFile(output_file):
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+def replaceFile(path, write):
+    #the file is written under a temporary name and renamed, so it is either complete or absent
+    temporary="{}.tmp".format(path)
+    with open(temporary, "wb") as temporary_file:
+        write(temporary_file)
+        syncFile(temporary_file)
+    os.replace(temporary, path)
+
+class Checkpoint:
+    """Work directory of the blocks of rows of the distance triangle already calculated.
+
+    The manifest describes the alignment, limit and blocks of the run and
+    lists the completed blocks. Each block is saved before the manifest names
+    it, so a run that is stopped at any point can be resumed.
+    """
+
+    def __init__(self, work_dir, sequence_dict, limit, resume=False, block_pairs=None):
+        self.work_dir=work_dir
+        self.manifest_path=os.path.join(work_dir, "manifest.json")
+        sequence_count=len(sequence_dict)
+        run={"version": 1,
+             "alignment": alignmentFingerprint(sequence_dict),
+             "sequences": sequence_count,
+             "limit": limit}
+        os.makedirs(work_dir, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            if not resume:
+                raise ValueError("{} holds a previous run, resume it with --p-resume or use an empty work directory".format(work_dir))
+            with open(self.manifest_path) as manifest_file:
+                self.manifest=json.load(manifest_file)
+            if any(self.manifest.get(key) != value for key, value in run.items()):
+                raise ValueError("{} holds a run of a different alignment or edit distance".format(work_dir))
+            print("Resuming with {} of {} blocks of distances already calculated".format(len(self.manifest["completed"]), len(self.manifest["blocks"])))
+        else:
+            total_pairs=sequence_count*(sequence_count-1)//2
+            run["blocks"]=pairTiles(sequence_count, -(-total_pairs//(block_pairs or checkpointpairs)))
+            run["completed"]=[]
+            self.manifest=run
+            self.save_manifest()
+
+    def blocks(self):
+        return [tuple(block) for block in self.manifest["blocks"]]
+
+    def block_path(self, start, stop):
+        return os.path.join(self.work_dir, "rows_{}_{}.npz".format(start, stop))
+
+    def save_manifest(self):
+        replaceFile(self.manifest_path, lambda manifest_file: manifest_file.write(json.dumps(self.manifest, indent=2).encode("utf-8")))
+
+    def load(self, start, stop):
+        #the rows of a completed block, or None
+        if [start, stop] not in self.manifest["completed"]:
+            return None
+        return loadRowBlock(self.block_path(start, stop))[1]
+
+    def save(self, start, stop, rows):
+        saveRowBlock(self.block_path(start, stop), start, rows)
+        self.manifest["completed"].append([start, stop])
+        self.save_manifest()
+
+    def remove(self):
+        for start, stop in self.manifest["completed"]:
+            os.remove(self.block_path(start, stop))
+        os.remove(self.manifest_path)
+
+def uniqueSequences(sequence_dict):
+    #groups of identical sequences and the first sequence of each group, which distances are calculated between
+    ids=list(sequence_dict.keys())
+    groups=identicalSequences(sequence_dict)
+    return groups, {ids[group[0]]: sequence_dict[ids[group[0]]] for group in groups}
+
+def shardRange(sequence_count, shard_number, shard_count):
+    #every shard of a split covers fixed rows of the triangle with about the same number of pairs,
+    #shards past the last tile of a small alignment are empty
+    tiles=pairTiles(sequence_count, shard_count)
+    return tiles[shard_number-1] if shard_number <= len(tiles) else (sequence_count, sequence_count)
+
+def writeShard(sequence_dict, shard_number, shard_count, path, engine="python", jobs=1):
+    #the distances of one shard, described by the alignment fingerprint and the rows and pairs it covers
+    groups, unique_dict=uniqueSequences(sequence_dict)
+    sequence_count=len(unique_dict)
+    start, stop=shardRange(sequence_count, shard_number, shard_count)
+    alignment=alignmentMatrix(unique_dict, engine)
+    if jobs > 1 and stop > start and alignment.size:
+        with distanceWorkers(alignment, engine, jobs) as pool:
+            rows=rangeDistanceRows(alignment, engine, start, stop, pool=pool, jobs=jobs)
+    else:
+        rows=rangeDistanceRows(alignment, engine, start, stop)
+    info={"alignment": alignmentFingerprint(unique_dict),
+          "sequences": sequence_count,
+          "shard": shard_number,
+          "shards": shard_count,
+          "start": start,
+          "stop": stop,
+          "pairs": sum(len(columns) for row, columns, distances in rows)}
+    saveRowBlock(path, start, rows, info)
+    return info
+
+def shardInfo(path):
+    import numpy as np
+    with np.load(path) as block:
+        return json.loads(str(block["info"]))
+
+def mergeShards(sequence_dict, shard_paths, database_path, database_format="tsv"):
+    #every shard is checked against the alignment and the split before the database is written
+    groups, unique_dict=uniqueSequences(sequence_dict)
+    sequence_count=len(unique_dict)
+    fingerprint=alignmentFingerprint(unique_dict)
+    shards={}
+    shard_count=None
+    for path in shard_paths:
+        info=shardInfo(path)
+        if info.get("alignment") != fingerprint or info.get("sequences") != sequence_count:
+            raise ValueError("{} is a shard of a different alignment".format(path))
+        if shard_count is None:
+            shard_count=info["shards"]
+        elif info["shards"] != shard_count:
+            raise ValueError("{} is shard {} of {}, the other shards are of {}".format(path, info["shard"], info["shards"], shard_count))
+        if info["shard"] in shards:
+            raise ValueError("{} and {} are both shard {}".format(shards[info["shard"]], path, info["shard"]))
+        start, stop=shardRange(sequence_count, info["shard"], shard_count)
+        if (info["start"], info["stop"]) != (start, stop) or info["pairs"] != sum(range(sequence_count-stop, sequence_count-start)):
+            raise ValueError("{} does not cover the pairs of shard {} of {}".format(path, info["shard"], shard_count))
+        shards[info["shard"]]=path
+    missing=[shard_number for shard_number in range(1, shard_count+1) if shard_number not in shards]
+    if missing:
+        raise ValueError("Shard {} of the {} shards is missing".format(",".join(str(shard_number) for shard_number in missing), shard_count))
+    ids=list(sequence_dict.keys())
+    with databaseWriter(ids, database_format, databaseItemsize(sequence_dict), database_path=database_path) as database_writer:
+        for row, columns, distances in expandedRows(shardRows(shards, shard_count), groups):
+            database_writer.write(row, columns, distances)
+    return shard_count
+
+def shardRows(shards, shard_count):
+    #the rows of every shard in order, one shard in memory at a time
+    for shard_number in range(1, shard_count+1):
+        yield from loadRowBlock(shards[shard_number])[1]
+
+def saveRowBlock(path, start, rows, info=None):
+    #consecutive rows from start as one npz file, with a JSON description of the block
+    import numpy as np
+    counts=[len(columns) for row, columns, distances in rows]
+    offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    columns=np.concatenate([columns for row, columns, distances in rows]+[np.zeros(0, dtype=np.int64)]).astype(np.int32)
+    distances=np.concatenate([distances for row, columns, distances in rows]+[np.zeros(0, dtype=np.int64)]).astype(np.int32)
+    replaceFile(path, lambda block_file: np.savez(block_file, start=np.int64(start), offsets=offsets, columns=columns, distances=distances,
+                                                  info=np.array(json.dumps(info or {}))))
+
+def loadRowBlock(path):
+    #the description and rows of a file written by saveRowBlock
+    import numpy as np
+    with np.load(path) as block:
+        start, offsets, columns, distances=int(block["start"]), block["offsets"], block["columns"], block["distances"]
+        info=json.loads(str(block["info"]))
+    rows=[(start+position, columns[offsets[position]:offsets[position+1]].astype(np.int64), distances[offsets[position]:offsets[position+1]].astype(np.int64))
+          for position in range(len(offsets)-1)]
+    return info, rows
+
+def rangeDistanceRows(alignment, engine, start, stop, limit=None, pool=None, jobs=1):
+    #the rows start to stop of tileDistances as a list, split across the distance workers of pool when given
+    if pool is None:
+        return list(tileDistances(alignment, engine, start, stop, limit))
+    tiles=[(tile_start, tile_stop, limit) for tile_start, tile_stop in pairTiles(len(alignment), jobs*4, start, stop)]
+    return [row for tile_rows in orderedResults(pool, workerTileDistances, tiles, jobs*2) for row in tile_rows]
+
+def checkpointedDistanceRows(sequence_dict, engine="python", jobs=1, limit=None, work_dir=None, resume=False):
+    #the rows of pairwiseDistanceRows, calculated a block at a time and saved to work_dir so a stopped run can resume,
+    #the work directory is checked before any row is calculated
+    checkpoint=Checkpoint(work_dir, sequence_dict, limit, resume)
+    return checkpointRows(checkpoint, sequence_dict, engine, jobs, limit)
+
+def checkpointRows(checkpoint, sequence_dict, engine, jobs, limit):
+    #the work directory is emptied once every row has been used
+    alignment=alignmentMatrix(sequence_dict, engine)
+    pool=distanceWorkers(alignment, engine, jobs) if jobs > 1 and alignment.size else None
+    try:
+        for start, stop in checkpoint.blocks():
+            rows=checkpoint.load(start, stop)
+            if rows is None:
+                rows=rangeDistanceRows(alignment, engine, start, stop, limit, pool, jobs)
+                checkpoint.save(start, stop, rows)
+            yield from rows
+    finally:
+        if pool is not None:
+            pool.terminate()
+    checkpoint.remove()
+
+def pairChunks(missing_rows, limit, chunk_pairs):
+    chunk=[]
+    pairs=0
+    for row, columns in missing_rows:
+        chunk.append((row, columns))
+        pairs+=len(columns)
+        if pairs >= chunk_pairs:
+            yield chunk, limit
+            chunk=[]
+            pairs=0
+    if chunk:
+        yield chunk, limit
+
+def missingDistanceRows(sequence_dict, missing_rows, engine="python", jobs=1, limit=None, chunk_pairs=100000):
+    #distances for (row, columns) pairs still to calculate, yielded as (row, columns, distances) in the same order,
+    #missing_rows is read as the distances are calculated
+    alignment=alignmentMatrix(sequence_dict, engine)
+    chunks=pairChunks(missing_rows, limit, chunk_pairs)
+    first_chunks=list(islice(chunks, 2))
+    chunks=chain(first_chunks, chunks)
+    if jobs > 1 and len(first_chunks) > 1 and alignment.size:
+        with distanceWorkers(alignment, engine, jobs) as pool:
+            for rows in orderedResults(pool, workerRowDistances, chunks, jobs*2):
+                yield from rows
+    else:
+        for rows, limit in chunks:
+            yield from chunkDistances(alignment, engine, rows, limit)
+
+def sequenceDigests(sequence_dict):
+    #the key of each aligned sequence in the distance cache
+    return {taxa: hashlib.sha256(seq.encode("ascii")).digest()[:16] for taxa, seq in sequence_dict.items()}
+
+class DistanceCache:
+    """Distances between sequences kept in a SQLite database across runs and alignments.
+
+    Pairs are keyed by digests of the aligned sequences, the same in every
+    alignment a sequence is aligned the same way in. Lookups and inserts are
+    batched, and once the database uses more than max_bytes the oldest
+    distances are removed.
+    """
+
+    def __init__(self, path, max_bytes=2**30, batch_size=100000):
+        self.max_bytes=max_bytes
+        self.batch_size=batch_size
+        self.pending=[]
+        self.hits=0
+        self.added=0
+        self.connection=sqlite3.connect(path)
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        #only takes effect on a new database, where freed pages can then be returned to the file system
+        self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS distances (first BLOB NOT NULL, second BLOB NOT NULL, distance INTEGER NOT NULL, UNIQUE (first, second))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS distances_second ON distances (second)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def restrict(self, digests):
+        """Number the digests of the sequences of this run, the rows lookup answers for."""
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS run (row INTEGER PRIMARY KEY, digest BLOB NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS temp.run_digest ON run (digest)")
+        with self.connection:
+            self.connection.execute("DELETE FROM run")
+            self.connection.executemany("INSERT INTO run VALUES (?, ?)", enumerate(digests))
+
+    def lookup(self, rows, first_column, last_column):
+        """Cached (row, column, distance) of rows with the columns from first_column to last_column."""
+        marks=",".join("?"*len(rows))
+        #both sides of each pair are filtered in the database, so pairs of other alignments are never read
+        query=("SELECT mine.row, other.row, distance FROM run AS mine JOIN distances ON distances.{0}=mine.digest "
+               "JOIN run AS other ON other.digest=distances.{1} WHERE mine.row IN ({2}) AND other.row BETWEEN ? AND ? AND other.row != mine.row")
+        return self.connection.execute(query.format("first", "second", marks)+" UNION ALL "+query.format("second", "first", marks)+" AND distances.first != distances.second",
+                                       rows+[first_column, last_column]+rows+[first_column, last_column]).fetchall()
+
+    def add(self, digest, others, distances):
+        self.pending.extend((min(digest, other), max(digest, other), distance) for other, distance in zip(others, distances))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany("INSERT OR IGNORE INTO distances VALUES (?, ?, ?)", self.pending)
+            self.added+=len(self.pending)
+            self.pending=[]
+            self.evict()
+
+    def size(self):
+        page_size, page_count, free_pages=(self.connection.execute("PRAGMA {}".format(pragma)).fetchone()[0] for pragma in ("page_size", "page_count", "freelist_count"))
+        return (page_count-free_pages)*page_size
+
+    def evict(self):
+        #the oldest distances are removed down to nine tenths of max_bytes,
+        #pages of the index are not emptied evenly so it can take a few rounds
+        used=self.size()
+        while used > self.max_bytes:
+            count=self.connection.execute("SELECT COUNT(*) FROM distances").fetchone()[0]
+            if not count:
+                break
+            remove=max(1, count-int(count*0.9*self.max_bytes/used))
+            with self.connection:
+                self.connection.execute("DELETE FROM distances WHERE rowid IN (SELECT rowid FROM distances ORDER BY rowid LIMIT ?)", (remove,))
+            self.connection.executescript("PRAGMA incremental_vacuum;")
+            used=self.size()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+def uncachedRows(missing_rows, cache, hits, batch_rows=500):
+    #(row, columns) of missing_rows without the cached pairs, which are queued in hits in the same order
+    import numpy as np
+    wanted=None
+    for batch in iter(lambda: list(islice(missing_rows, batch_rows)), []):
+        partners=defaultdict(list)
+        batch_columns=[columns for row, columns in batch if len(columns)]
+        if batch_columns:
+            first_column=min(int(columns.min()) for columns in batch_columns)
+            last_column=max(int(columns.max()) for columns in batch_columns)
+            for row, column, distance in cache.lookup([row for row, columns in batch], first_column, last_column):
+                partners[row].append((column, distance))
+            if wanted is None or len(wanted) <= last_column:
+                wanted=np.zeros(last_column+1, dtype=bool)
+        for row, columns in batch:
+            found=partners.get(row, ())
+            if found:
+                wanted[columns]=True
+                found=[(column, distance) for column, distance in found if wanted[column]]
+                wanted[columns]=False
+            hit_columns=np.array([column for column, distance in found], dtype=np.int64)
+            hit_distances=np.array([distance for column, distance in found], dtype=np.int64)
+            hits.append((hit_columns, hit_distances))
+            yield row, columns[np.isin(columns, hit_columns, invert=True)] if len(hit_columns) else columns
+
+def cachedDistanceRows(sequence_dict, missing_rows, digests, cache, engine="python", jobs=1, limit=None):
+    #the rows of missingDistanceRows with the pairs found in the cache filled in, calculated pairs are added to the cache.
+    #digests holds the digest of each row, with a limit only distances within it are exact and cached
+    import numpy as np
+    hits=deque()
+    cache.restrict(digests)
+    calculated=missingDistanceRows(sequence_dict, uncachedRows(iter(missing_rows), cache, hits), engine, jobs, limit)
+    for row, columns, distances in calculated:
+        hit_columns, hit_distances=hits.popleft()
+        exact=distances <= limit if limit is not None else slice(None)
+        cache.add(digests[row], [digests[column] for column in columns[exact].tolist()], distances[exact].tolist())
+        cache.hits+=len(hit_columns)
+        columns=np.concatenate([hit_columns, columns])
+        distances=np.concatenate([hit_distances, distances])
+        order=np.argsort(columns, kind="stable")
+        yield row, columns[order], distances[order]
+    cache.flush()
+
+def distanceRowsFor(sequence_dict, missing_rows, engine="python", jobs=1, limit=None, cache=None, digests=None):
+    #missing distances from the cache when one is given
+    if cache is None:
+        return missingDistanceRows(sequence_dict, missing_rows, engine, jobs, limit)
+    return cachedDistanceRows(sequence_dict, missing_rows, [digests[taxa] for taxa in sequence_dict], cache, engine, jobs, limit)
+
+def missingRows(sequence_count, new_rows, holes=()):
+    #every pair with a new sequence once, followed by the pairs of known sequences that were never calculated
+    import numpy as np
+    is_new=np.zeros(sequence_count, dtype=bool)
+    is_new[new_rows]=True
+    missing_rows=[]
+    columns=np.arange(sequence_count)
+    for row in np.flatnonzero(is_new).tolist():
+        missing_rows.append((row, columns[(~is_new | (columns < row)) & (columns != row)]))
+    missing_rows.extend(holes)
+    return missing_rows
+
+def identicalSequences(sequence_dict):
+    #rows of byte-identical sequences grouped together, in the order each sequence first appears
+    groups={}
+    for row, seq in enumerate(sequence_dict.values()):
+        groups.setdefault(seq, []).append(row)
+    return list(groups.values())
+
+def expandedRows(rows, groups):
+    #maps (row, columns, distances) between the first sequences of groups back to every member,
+    #identical sequences are at distance 0 from each other
+    import numpy as np
+    members=np.array([row for group in groups for row in group], dtype=np.int64)
+    sizes=np.array([len(group) for group in groups], dtype=np.int64)
+    starts=np.cumsum(sizes)-sizes
+    for group in groups:
+        for position, row in enumerate(group[:-1]):
+            columns=np.array(group[position+1:], dtype=np.int64)
+            yield row, columns, np.zeros(len(columns), dtype=np.int64)
+    for row, columns, distances in rows:
+        counts=sizes[columns]
+        if sizes[row] == 1 and counts.sum() == len(columns):
+            #no identical sequences involved, the first members keep the order of the rows
+            yield members[starts[row]], members[starts[columns]], distances
+            continue
+        firsts=np.cumsum(counts)-counts
+        columns=members[np.repeat(starts[columns]-firsts, counts)+np.arange(counts.sum())]
+        distances=np.repeat(distances, counts)
+        for member in groups[row]:
+            #each pair is written with the earlier sequence first
+            yield np.minimum(member, columns), np.maximum(member, columns), distances
+
+#Block index: two sequences within d of each other can only differ in at most d of
+#k > d blocks of columns. Only unambiguous bases take part in block signatures,
+#a block holding a gap or an ambiguity code is wild for that sequence and pairs
+#that could rely on a wild block are kept as candidates.
+plainbitmasks=[iupacbitmask[code] for code in "ACGTU"]
+
+def blockPlan(encoded, clean, columns, block_count):
+    #signature of every sequence in each block, -1 where the block is wild
+    import numpy as np
+    signatures=np.full((len(encoded), block_count), -1, dtype=np.int64)
+    for block, block_columns in enumerate(np.array_split(columns, block_count)):
+        block_clean=clean[:, block_columns].all(axis=1)
+        rows=np.flatnonzero(block_clean)
+        block_bytes=np.ascontiguousarray(encoded[np.ix_(rows, block_columns)])
+        if rows.size:
+            signatures[rows, block]=np.unique(block_bytes.view(np.dtype((np.void, len(block_columns)))).ravel(), return_inverse=True)[1].ravel()
+    return signatures
+
+def blockPairs(signatures, editdistance_value, count_only=False):
+    #candidate pairs as arrays of first and second rows, every pair within the edit distance is included,
+    #with count_only just the number of pairs before duplicates between blocks are removed
+    import numpy as np
+    sequence_count, block_count=signatures.shape
+    wild_counts=(signatures < 0).sum(axis=1)
+    #pairs with fewer wild blocks between them than block_count-editdistance_value share a signature
+    clean_limit=block_count-editdistance_value
+    pair_count=0
+    firsts=[]
+    seconds=[]
+    for block in range(block_count):
+        block_signatures=signatures[:, block]
+        rows=np.flatnonzero(block_signatures >= 0)
+        rows=rows[np.argsort(block_signatures[rows], kind="stable")]
+        sorted_signatures=block_signatures[rows]
+        if count_only:
+            sizes=np.unique(sorted_signatures, return_counts=True)[1]
+            pair_count+=int((sizes*(sizes-1)//2).sum())
+        else:
+            #rows i and i+offset share a signature only if every row between them does
+            positions=np.arange(len(rows)-1)
+            offset=1
+            while positions.size:
+                positions=positions[sorted_signatures[positions] == sorted_signatures[positions+offset]]
+                firsts.append(rows[positions])
+                seconds.append(rows[positions+offset])
+                offset+=1
+                positions=positions[positions+offset < len(rows)]
+        #a sequence that is clean here with v wild blocks meets sequences wild here with at least clean_limit-v wild blocks
+        wild_rows=np.flatnonzero(block_signatures < 0)
+        for wild_count in range(clean_limit):
+            clean_rows=rows[wild_counts[rows] == wild_count]
+            other_rows=wild_rows[wild_counts[wild_rows] >= clean_limit-wild_count]
+            pair_count+=clean_rows.size*other_rows.size
+            if clean_rows.size and other_rows.size and not count_only:
+                firsts.append(np.repeat(clean_rows, other_rows.size))
+                seconds.append(np.tile(other_rows, clean_rows.size))
+    #sequences with clean_limit or more wild blocks are compared with each other
+    wild_rows=np.flatnonzero(wild_counts >= clean_limit)
+    pair_count+=len(wild_rows)*(len(wild_rows)-1)//2
+    if count_only:
+        return pair_count
+    first, second=np.triu_indices(len(wild_rows), 1)
+    firsts.append(wild_rows[first])
+    seconds.append(wild_rows[second])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def blockCandidateRows(encoded, editdistance_value, wild_fraction=0.01):
+    """Candidate (row, columns) pairs from a block index over the encoded alignment.
+
+    Only columns that vary and hold a gap or ambiguity code in at most
+    wild_fraction of the sequences are split into blocks. The number of blocks
+    with the fewest candidates is used, and every pair within the edit
+    distance is among the candidates. Returns None when too few columns vary
+    for the index to help.
+    """
+    import numpy as np
+    sequence_count=len(encoded)
+    clean=np.isin(encoded, plainbitmasks)
+    varying=(encoded != encoded[:1]).any(axis=0)
+    columns=np.flatnonzero(varying & ((~clean).sum(axis=0) <= wild_fraction*sequence_count))
+    if len(columns) <= editdistance_value or sequence_count < 2:
+        return None
+    block_counts=range(editdistance_value+1, min(3*(editdistance_value+1), len(columns))+1)
+    block_count=min(block_counts, key=lambda block_count: blockPairs(blockPlan(encoded, clean, columns, block_count), editdistance_value, True))
+    firsts, seconds=blockPairs(blockPlan(encoded, clean, columns, block_count), editdistance_value)
+    codes=np.sort(np.minimum(firsts, seconds)*sequence_count+np.maximum(firsts, seconds))
+    codes=codes[np.concatenate([[True], codes[1:] != codes[:-1]])]
+    rows=codes//sequence_count
+    bounds=np.flatnonzero(np.diff(rows))+1
+    return [(int(row_columns[0]//sequence_count), row_columns%sequence_count) for row_columns in np.split(codes, bounds) if row_columns.size]
+
+class NeighbourGraph:
+    """Pairs of sequences within max_distance of each other as compressed sparse rows.
+
+    Sequences are referred to by their index in ids. The neighbours of sequence
+    row are neighbours[offsets[row]:offsets[row+1]], sorted by index, and
+    distances holds the matching edit distances. Every pair is stored in both
+    directions.
+    """
+
+    def __init__(self, ids, offsets, neighbours, distances, max_distance):
+        self.ids=ids
+        self.index={taxa: row for row, taxa in enumerate(ids)}
+        self.offsets=offsets
+        self.neighbours=neighbours
+        self.distances=distances
+        self.max_distance=max_distance
+
+    @classmethod
+    def from_rows(cls, ids, rows, max_distance):
+        """Build the graph from (row, columns, distances) chunks, keeping the pairs within max_distance.
+
+        row is either a single index or an array matching columns.
+        """
+        import numpy as np
+        kept_rows=[np.zeros(0, dtype=np.int64)]
+        kept_columns=[np.zeros(0, dtype=np.int64)]
+        kept_distances=[np.zeros(0, dtype=np.int64)]
+        for row, columns, distances in rows:
+            within=distances <= max_distance
+            if within.any():
+                kept_rows.append(np.broadcast_to(row, within.shape)[within])
+                kept_columns.append(columns[within])
+                kept_distances.append(distances[within])
+        return cls.from_arrays(ids, np.concatenate(kept_rows), np.concatenate(kept_columns), np.concatenate(kept_distances), max_distance)
+
+    @classmethod
+    def from_arrays(cls, ids, rows, columns, distances, max_distance):
+        """Build the graph from arrays holding each pair once."""
+        import numpy as np
+        sources=np.concatenate([rows, columns])
+        targets=np.concatenate([columns, rows])
+        order=np.lexsort((targets, sources))
+        offsets=np.zeros(len(ids)+1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(ids)), out=offsets[1:])
+        distance_type=np.uint16 if max_distance <= np.iinfo(np.uint16).max else np.uint32
+        return cls(ids, offsets, targets[order].astype(np.int32), np.concatenate([distances, distances])[order].astype(distance_type), max_distance)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def pair_count(self):
+        return len(self.neighbours)//2
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes+self.neighbours.nbytes+self.distances.nbytes
+
+    def neighbours_within(self, row, max_distance):
+        """Indices of the neighbours of row at a distance of max_distance or less."""
+        row_slice=slice(self.offsets[row], self.offsets[row+1])
+        return self.neighbours[row_slice][self.distances[row_slice] <= max_distance]
+
+    def distance(self, row, column):
+        """Distance between two sequences, or None if it is above max_distance."""
+        import numpy as np
+        row_neighbours=self.neighbours[self.offsets[row]:self.offsets[row+1]]
+        position=np.searchsorted(row_neighbours, column)
+        if position < len(row_neighbours) and row_neighbours[position] == column:
+            return int(self.distances[self.offsets[row]+position])
+        return None
+
+    def distance_counts(self, distance):
+        """Number of neighbours of every sequence at exactly distance."""
+        import numpy as np
+        sources=np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+        return np.bincount(sources[self.distances == distance], minlength=len(self.ids))
+
+def databasePath(extension):
+    #new databases are named by the time they are written
+    return 'distance_dictionary_{}.{}'.format(time.strftime("%Y%m%d-%H%M%S"), extension)
+
+#Binary distance database: a header, row i of the lower triangle for every
+#sequence i (its distances to sequences 0 to i-1) and the newline separated identifiers.
+#New sequences only add rows to the end of the triangle.
+databasemagic=b"DISCODB\x00"
+databaseheader=struct.Struct("<8sHHQQQ")#magic, version, bytes per distance, number of sequences, offset and length of the identifiers
+databaseheadersize=64
+databaseversion=1
+
+def triangleOffset(row):
+    return row*(row-1)//2
+
+def isBinaryDatabase(path):
+    with open(path, "rb") as database_file:
+        return database_file.read(len(databasemagic)) == databasemagic
+
+def databaseItemsize(sequence_dict):
+    #bytes per distance, the largest value marks pairs that have not been calculated
+    import numpy as np
+    length=max((len(seq) for seq in sequence_dict.values()), default=0)
+    return 2 if length < np.iinfo(np.uint16).max else 4
+
+class DistanceDatabase:
+    """Read-only view of a binary distance database through mmap.
+
+    Nothing is parsed apart from the header and identifiers, rows of the
+    triangle are read from the mapped file only when requested.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+        self.file=open(path, "rb")
+        self.mmap=mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, itemsize, sequence_count, ids_offset, ids_length=databaseheader.unpack_from(self.mmap)
+        if magic != databasemagic or version != databaseversion:
+            raise ValueError("{} is not a binary distance database".format(path))
+        self.dtype=np.dtype("<u{}".format(itemsize))
+        self.missing=np.iinfo(self.dtype).max
+        self.ids=self.mmap[ids_offset:ids_offset+ids_length].decode("utf-8").split("\n") if sequence_count else []
+        self.matrix=np.frombuffer(self.mmap, dtype=self.dtype, count=triangleOffset(sequence_count), offset=databaseheadersize)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def row(self, row):
+        """Distances from sequence row to every earlier sequence."""
+        return self.matrix[triangleOffset(row):triangleOffset(row+1)]
+
+    def close(self):
+        self.matrix=None
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass #rows are still referenced elsewhere, the map closes when they are released
+        self.file.close()
+
+def databaseFields(line):
+    #the last line of a tsv database is left unfinished when a run adding to it is stopped, it is skipped
+    fields=line.strip().split("\t")
+    return fields if len(fields) == 3 and fields[2].isdigit() else None
+
+def finishLastLine(path):
+    #an unfinished last line is removed before more lines are added after it
+    with open(path, "r+b") as database_file:
+        size=database_file.seek(0, os.SEEK_END)
+        tail=b""
+        while size > len(tail) and b"\n" not in tail:
+            start=max(0, size-len(tail)-65536)
+            database_file.seek(start)
+            tail=database_file.read(size-len(tail)-start)+tail
+        if not tail or tail.endswith(b"\n"):
+            return
+        last_line=tail[tail.rfind(b"\n")+1:]
+        if databaseFields(last_line.decode("utf-8", "replace")) is None:
+            database_file.truncate(size-len(last_line))
+        else:
+            database_file.write(b"\n")
+
+class DatabaseWriter:
+    """Discards distances, used in threshold mode where the database would be incomplete."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, rows, columns, distances):
+        pass
+
+    def write_line(self, line):
+        pass
+
+    def close(self):
+        pass
+
+class TsvDatabaseWriter(DatabaseWriter):
+    """Writes one tab-delimited line for each pair."""
+
+    def __init__(self, path, ids, append=False):
+        self.ids=ids
+        if append:
+            finishLastLine(path)
+        self.file=open(path, "a" if append else "w+")
+
+    def write(self, rows, columns, distances):
+        import numpy as np
+        ids=self.ids
+        rows=np.broadcast_to(rows, np.shape(columns))
+        self.file.write("".join("{}\t{}\t{}\n".format(ids[row], ids[column], edvalue) for row, column, edvalue in zip(rows.tolist(), columns.tolist(), distances.tolist())))
+
+    def write_line(self, line):
+        self.file.write("{}\n".format(line))
+
+    def close(self):
+        self.file.close()
+
+class BinaryDatabaseWriter(DatabaseWriter):
+    """Writes distances into a binary database through a memory map.
+
+    With existing, path already holds a database of the first existing ids and
+    the rows of the remaining ids are added to the end of its triangle. The
+    database stays readable as the first existing ids until the header is
+    updated, once all rows have been written.
+    """
+
+    def __init__(self, path, ids, itemsize=2, existing=0):
+        import numpy as np
+        self.ids=ids
+        self.path=path
+        self.itemsize=itemsize
+        sequence_count=len(ids)
+        id_block="\n".join(ids).encode("utf-8")
+        self.ids_offset=databaseheadersize+triangleOffset(sequence_count)*itemsize
+        self.ids_length=len(id_block)
+        if existing:
+            with DistanceDatabase(path) as database:
+                if database.ids != ids[:existing] or database.dtype.itemsize != itemsize:
+                    raise ValueError("{} does not start with the same sequences".format(path))
+                old_ids_end=databaseheader.unpack_from(database.mmap)[4]+len("\n".join(database.ids).encode("utf-8"))
+            #the new identifiers are written past the old ones, and the header moved to the existing ids at
+            #the start of them, before the old identifiers are overwritten by the new rows
+            self.ids_offset=max(self.ids_offset, old_ids_end)
+            with open(path, "r+b") as database_file:
+                database_file.seek(self.ids_offset)
+                database_file.write(id_block)
+                database_file.truncate()
+                syncFile(database_file)
+                database_file.seek(0)
+                database_file.write(self.header(existing, self.ids_offset, len("\n".join(ids[:existing]).encode("utf-8"))))
+                syncFile(database_file)
         else:
-            edvalue=customeditdistance(sequence_dict[keys[0]],sequence_dict[keys[1]])
-            dict_ed[keys[0]][edvalue].append(keys[1])
-            dict_ed[keys[1]][edvalue].append(keys[0])
-            dictionary_file.write("{}\t{}\t{}\n".format(keys[0],keys[1],edvalue))
+            with open(path, "wb") as database_file:
+                database_file.write(self.header(0, databaseheadersize, 0))
+                database_file.seek(self.ids_offset)
+                database_file.write(id_block)
+        dtype=np.dtype("<u{}".format(itemsize))
+        self.matrix=np.memmap(path, dtype=dtype, mode="r+", offset=databaseheadersize, shape=(triangleOffset(sequence_count),)) if sequence_count > 1 else np.zeros(0, dtype=dtype)
+        self.matrix[triangleOffset(existing):]=np.iinfo(dtype).max
+
+    def header(self, sequence_count, ids_offset, ids_length):
+        return databaseheader.pack(databasemagic, databaseversion, self.itemsize, sequence_count, ids_offset, ids_length).ljust(databaseheadersize, b"\0")
+
+    def write(self, rows, columns, distances):
+        import numpy as np
+        rows=np.broadcast_to(rows, np.shape(columns))
+        self.matrix[triangleOffset(np.maximum(rows, columns))+np.minimum(rows, columns)]=distances
 
-    return dict_ed
+    def close(self):
+        import numpy as np
+        if isinstance(self.matrix, np.memmap):
+            self.matrix.flush()
+        self.matrix=None
+        with open(self.path, "r+b") as database_file:
+            database_file.write(self.header(len(self.ids), self.ids_offset, self.ids_length))
+            syncFile(database_file)
 
-def duplicatelist(dict_ed):
+def databaseWriter(ids, database_format="tsv", itemsize=2, threshold=False, database_path=None):
+    #threshold mode only knows the pairs within the edit distance so no database is kept
+    if threshold:
+        return DatabaseWriter()
+    if database_format == "binary":
+        return BinaryDatabaseWriter(database_path or databasePath("bin"), ids, itemsize)
+    return TsvDatabaseWriter(database_path or databasePath("txt"), ids)
+
+def writtenRows(rows, database_writer):
+    for row, columns, distances in rows:
+        database_writer.write(row, columns, distances)
+        yield row, columns, distances
+
+def editDistanceDictionary(sequence_dict, editdistance_value, engine="python", jobs=1, threshold=False, database_format="tsv", block_index=False, write_database=True, database_path=None, progress=None, work_dir=None, resume=False, cache=None, digests=None):
+    import numpy as np
+    ids=list(sequence_dict.keys())
+    limit=editdistance_value if threshold else None
+    #distances are only calculated between the first of each group of identical sequences
+    groups, unique_dict=uniqueSequences(sequence_dict)
+    print("Calculating distances between {} distinct sequences".format(len(unique_dict)))
+    candidate_rows=blockCandidateRows(encodeAlignment(unique_dict), editdistance_value) if block_index else None
+    if candidate_rows is not None:
+        #the block index only finds the pairs within the edit distance, so it is used with threshold mode
+        print("The block index selected {} of {} pairs for comparison".format(sum(len(columns) for row, columns in candidate_rows), len(unique_dict)*(len(unique_dict)-1)//2))
+        distance_rows=progressRows(distanceRowsFor(unique_dict, candidate_rows, engine, jobs, limit, cache, digests), progress,
+                                   sum(len(columns) for row, columns in candidate_rows), lambda row, columns: len(columns))
+    else:
+        if work_dir is not None:
+            distance_rows=checkpointedDistanceRows(unique_dict, engine, jobs, limit, work_dir, resume)
+        elif cache is not None:
+            all_rows=((row, np.arange(row+1, len(unique_dict))) for row in range(len(unique_dict)))
+            distance_rows=distanceRowsFor(unique_dict, all_rows, engine, jobs, limit, cache, digests)
+        else:
+            distance_rows=pairwiseDistanceRows(unique_dict, engine, jobs, limit)
+        #with a limit only the later rows within it are yielded, but the row was compared to every later row
+        distance_rows=progressRows(distance_rows, progress,
+                                   len(unique_dict)*(len(unique_dict)-1)//2, lambda row, columns: len(unique_dict)-1-row)
+    with databaseWriter(ids, database_format, databaseItemsize(sequence_dict), threshold or not write_database, database_path) as database_writer:
+        rows=writtenRows(expandedRows(distance_rows, groups), database_writer)
+        return NeighbourGraph.from_rows(ids, rows, editdistance_value)
+
+def readEDdictionary(sequence_dict,database_path,editdistance_value,engine="python",jobs=1,threshold=False,update=False,batch_size=100000,write_database=True,output_path=None,progress=None,cache=None,digests=None):
+    #the pairs known for each sequence are counted, only sequences missing some of their pairs are read again
+    #to find which, so the missing pairs are calculated without holding a flag for every pair
+    import numpy as np
+    ids=list(sequence_dict.keys())
+    index={taxa: row for row, taxa in enumerate(ids)}
+    known_counts=np.zeros(len(ids), dtype=np.int64)
+    in_database=np.zeros(len(ids), dtype=bool)
+    known_rows=[]
+    limit=editdistance_value if threshold else None
+    #without update the database is copied to a new file followed by the new distances
+    database_writer=databaseWriter(ids, "tsv", threshold=threshold or update or not write_database, database_path=output_path)
+    with open(database_path) as input_ed_dict:
+        while True:
+            batch=[line.strip() for line in islice(input_ed_dict, batch_size)]
+            if not batch:
+                break
+            rows=[]
+            columns=[]
+            distances=[]
+            for line in batch:
+                fields=databaseFields(line)
+                if fields is None:
+                    continue
+                database_writer.write_line(line)
+                #pairs of sequences that are not in the alignment are kept in the database only
+                if fields[0] in index and fields[1] in index:
+                    rows.append(index[fields[0]])
+                    columns.append(index[fields[1]])
+                    distances.append(int(fields[2]))
+            rows=np.array(rows, dtype=np.int64)
+            columns=np.array(columns, dtype=np.int64)
+            distances=np.array(distances, dtype=np.int64)
+            in_database[rows]=True
+            in_database[columns]=True
+            known_counts+=np.bincount(rows, minlength=len(ids))+np.bincount(columns, minlength=len(ids))
+            within=distances <= editdistance_value
+            known_rows.append((rows[within], columns[within], distances[within]))
+    new_rows=np.flatnonzero(~in_database)
+    holes=databaseHoles(database_path, index, in_database, known_counts)
+    missing_rows=missingRows(len(ids), new_rows, holes)
+    print("The distance database has {} of the {} sequences, {} pairs are missing".format(len(ids)-len(new_rows), len(ids), sum(len(columns) for row, columns in missing_rows)))
+    if update and write_database and not threshold and missing_rows:
+        database_writer=TsvDatabaseWriter(database_path, ids, append=True)
+    with database_writer:
+        distance_rows=progressRows(distanceRowsFor(sequence_dict, missing_rows, engine, jobs, limit, cache, digests), progress,
+                                   sum(len(columns) for row, columns in missing_rows), lambda row, columns: len(columns))
+        rows=writtenRows(distance_rows, database_writer)
+        return NeighbourGraph.from_rows(ids, chain(known_rows, rows), editdistance_value)
+
+def databaseHoles(database_path, index, in_database, known_counts):
+    #(row, earlier columns) of the pairs of sequences in a tsv database that it does not hold,
+    #both sequences of such a pair know fewer pairs than there are other sequences in the database
+    import numpy as np
+    short=np.flatnonzero(in_database & (known_counts < np.count_nonzero(in_database)-1))
+    if not len(short):
+        return []
+    partners={row: set() for row in short.tolist()}
+    with open(database_path) as input_ed_dict:
+        for line in input_ed_dict:
+            fields=databaseFields(line)
+            if fields is None or fields[0] not in index or fields[1] not in index:
+                continue
+            row, column=index[fields[0]], index[fields[1]]
+            if row in partners:
+                partners[row].add(column)
+            if column in partners:
+                partners[column].add(row)
+    holes=[]
+    for row in short.tolist():
+        columns=np.flatnonzero(in_database[:row])
+        columns=columns[np.array([column not in partners[row] for column in columns.tolist()], dtype=bool)]
+        if len(columns):
+            holes.append((row, columns))
+    return holes
+
+def readDistanceDatabase(sequence_dict,database_path,editdistance_value,engine="python",jobs=1,threshold=False,update=False,write_database=True,output_path=None,progress=None,cache=None,digests=None):
+    #only the rows of sequences in the alignment are read from the binary database
+    import numpy as np
+    ids=list(sequence_dict.keys())
+    with DistanceDatabase(database_path) as database:
+        database_index={taxa: row for row, taxa in enumerate(database.ids)}
+        alignment_rows=np.full(len(database), -1, dtype=np.int64)
+        for row, taxa in enumerate(ids):
+            if taxa in database_index:
+                alignment_rows[database_index[taxa]]=row
+        known_rows=[]
+        holes=[]
+        for database_row in np.flatnonzero(alignment_rows >= 0).tolist():
+            row=int(alignment_rows[database_row])
+            distances=database.row(database_row)
+            columns=alignment_rows[:database_row]
+            in_alignment=columns >= 0
+            within=in_alignment & (distances <= editdistance_value)
+            known_rows.append((row, columns[within], distances[within].astype(np.int64)))
+            missing=in_alignment & (distances == database.missing)
+            if missing.any():
+                holes.append((row, columns[missing]))
+        new_rows=[row for row, taxa in enumerate(ids) if taxa not in database_index]
+        missing_rows=missingRows(len(ids), new_rows, holes)
+        print("The distance database has {} of the {} sequences, {} pairs are missing".format(len(ids)-len(new_rows), len(ids), sum(len(columns) for row, columns in missing_rows)))
+        #new sequences are added after the sequences already in the database
+        database_ids=database.ids+[ids[row] for row in new_rows]
+        database_rows=np.zeros(len(ids), dtype=np.int64)
+        database_rows[alignment_rows[alignment_rows >= 0]]=np.flatnonzero(alignment_rows >= 0)
+        database_rows[new_rows]=len(database)+np.arange(len(new_rows))
+        existing=len(database)
+        itemsize=database.dtype.itemsize
+        limit=editdistance_value if threshold else None
+        if threshold or not missing_rows or not write_database:
+            database_writer=DatabaseWriter()
+        elif update:
+            database.close()
+            database_writer=BinaryDatabaseWriter(database_path, database_ids, itemsize, existing)
+        else:
+            database_writer=BinaryDatabaseWriter(output_path or databasePath("bin"), database_ids, itemsize)
+            #the existing triangle is the start of the triangle that includes the new sequences
+            database_writer.matrix[:len(database.matrix)]=database.matrix
+        with database_writer:
+            rows=[]
+            distance_rows=progressRows(distanceRowsFor(sequence_dict, missing_rows, engine, jobs, limit, cache, digests), progress,
+                                       sum(len(columns) for row, columns in missing_rows), lambda row, columns: len(columns))
+            for row, columns, distances in distance_rows:
+                database_writer.write(database_rows[row], database_rows[columns], distances)
+                within=distances <= editdistance_value
+                rows.append((row, columns[within], distances[within]))
+            return NeighbourGraph.from_rows(ids, chain(known_rows, rows), editdistance_value)
+
+def tsvToBinary(tsv_path, binary_path, batch_size=100000):
+    #the first pass collects the identifiers and the largest distance
+    import numpy as np
+    ids={}
+    largest=0
+    with open(tsv_path) as tsv_file:
+        for line in tsv_file:
+            fields=databaseFields(line)
+            if fields is None:
+                continue
+            ids.setdefault(fields[0], len(ids))
+            ids.setdefault(fields[1], len(ids))
+            largest=max(largest, int(fields[2]))
+    itemsize=2 if largest < np.iinfo(np.uint16).max else 4
+    with BinaryDatabaseWriter(binary_path, list(ids), itemsize) as database_writer, open(tsv_path) as tsv_file:
+        while True:
+            batch=list(islice(tsv_file, batch_size))
+            if not batch:
+                break
+            batch=[fields for fields in map(databaseFields, batch) if fields is not None]
+            database_writer.write(np.array([ids[fields[0]] for fields in batch], dtype=np.int64),
+                                  np.array([ids[fields[1]] for fields in batch], dtype=np.int64),
+                                  np.array([int(fields[2]) for fields in batch], dtype=np.int64))
+    return len(ids)
+
+def binaryToTsv(binary_path, tsv_path):
+    #pairs that were never calculated are left out
+    import numpy as np
+    with DistanceDatabase(binary_path) as database, TsvDatabaseWriter(tsv_path, database.ids) as database_writer:
+        for row in range(1, len(database)):
+            distances=database.row(row)
+            columns=np.flatnonzero(distances != database.missing)
+            database_writer.write(columns, np.full(len(columns), row), distances[columns])
+        return len(database)
+
+def duplicatelist(graph):
     duplist=[]
-    for key in dict_ed:
-        if key in duplist:
+    duplicate_rows=set()
+    for row in range(len(graph)):
+        if row in duplicate_rows:
             continue
         else:
-            duplist.extend(dict_ed[key][0])
+            duplicates=graph.neighbours_within(row, 0).tolist()
+            duplicate_rows.update(duplicates)
+            duplist.extend(graph.ids[duplicate] for duplicate in duplicates)
     return duplist
 
+def peakMemory():
+    #peak resident memory in MB of this process and of its largest child process, or None where the
+    #resource module is missing, as on Windows. ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    scale=1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*scale/2**20,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss*scale/2**20)
+
+def cpuTime():
+    #CPU time of this process and of its finished child processes, such as a closed pool
+    times=os.times()
+    return times.user+times.system+times.children_user+times.children_system
+
+def duration(seconds):
+    minutes, seconds=divmod(int(seconds), 60)
+    hours, minutes=divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds)
+
+class Profile:
+    """Wall and CPU time of the phases of a run, one after the other.
+
+    Starting a phase ends the one before. The distance calculations report
+    their progress through progress_rows and the community phases their
+    number of greedy iterations. Nothing is printed unless enabled.
+    """
+
+    def __init__(self, enabled=False, interval=10):
+        self.enabled=enabled
+        self.interval=interval
+        self.phases=[]
+        self.current=None
+        self.distances=None
+
+    def phase(self, name, **details):
+        self.end()
+        self.current=dict(phase=name, **details)
+        self.start=(time.perf_counter(), cpuTime())
+
+    def end(self, **details):
+        if self.current is None:
+            return
+        wall=time.perf_counter()-self.start[0]
+        cpu=cpuTime()-self.start[1]
+        self.current.update(details, wall_seconds=wall, cpu_seconds=cpu)
+        if "iterations" in details:
+            self.current["iterations_per_second"]=details["iterations"]/wall if wall else None
+        if self.enabled:
+            label=" ".join("{} {}".format(key, value) for key, value in self.current.items() if key not in ("phase", "wall_seconds", "cpu_seconds", "iterations_per_second"))
+            print("Phase {}{} took {} ({:.2f} s wall, {:.2f} s CPU)".format(self.current["phase"], " ({})".format(label) if label else "", duration(wall), wall, cpu))
+            if self.current.get("iterations_per_second"):
+                print("{:.0f} greedy iterations per second".format(self.current["iterations_per_second"]))
+        self.phases.append(self.current)
+        self.current=None
+
+    def progress_rows(self, rows, total_pairs, row_pairs):
+        """Pass (row, columns, distances) rows through, counting the row_pairs(row, columns) pairs compared for each."""
+        start=time.perf_counter()
+        last=start
+        done=0
+        for row, columns, distances in rows:
+            done+=row_pairs(row, columns)
+            yield row, columns, distances
+            now=time.perf_counter()
+            if self.enabled and now-last >= self.interval:
+                last=now
+                rate=done/(now-start)
+                print("Calculated {} of {} pairs ({:.1f}%), {:.0f} pairs per second, {} remaining".format(
+                    done, total_pairs, 100*done/max(1, total_pairs), rate, duration((total_pairs-done)/rate) if rate else "unknown"), flush=True)
+        seconds=time.perf_counter()-start
+        self.distances={"pairs": done, "seconds": seconds, "pairs_per_second": done/seconds if seconds else None}
+        if self.enabled:
+            print("Calculated {} pairs in {} ({:.0f} pairs per second)".format(done, duration(seconds), done/seconds if seconds else 0))
+
+    def report(self, path, **summary):
+        self.end()
+        with open(path, "w") as report_file:
+            json.dump(dict(summary, version=__version__, phases=self.phases, distances=self.distances), report_file, indent=2)
+
+def progressRows(rows, progress, total_pairs, row_pairs):
+    #rows are only counted when a Profile is given
+    if progress is None:
+        return rows
+    return progress.progress_rows(rows, total_pairs, row_pairs)
+
 def startcommunity(input_community):
     starter_community=[]
     for line in input_community:
@@ -386,102 +1917,336 @@ def startcommunity(input_community):
         starter_community.append(line)
     return starter_community
 
-def validateCommunity(starter_community,editdistance_value,edit_distance_dictionary):
+def validateCommunity(starter_community,editdistance_value,graph):
+    #conflicts are looked up among the neighbours of each member rather than by comparing every pair of members,
+    #and are listed in the order of the pairs of starter_community
+    positions=defaultdict(list)
+    for position, member in enumerate(starter_community):
+        #identifiers missing from the alignment have no neighbours
+        if member in graph.index:
+            positions[graph.index[member]].append(position)
+    conflicts=[]
+    for row, row_positions in list(positions.items()):
+        for neighbour in graph.neighbours_within(row, editdistance_value).tolist():
+            if neighbour in positions:
+                conflicts.extend((first, second) for first in row_positions for second in positions[neighbour] if first < second)
     community_validity=[]
-    distances=list(range(editdistance_value)) #Create a list of numbers below edit distance value
-    distances.append(editdistance_value)# append edit distance value to list
-    for pair in combinations(starter_community,2):
-        if any([pair[0] in edit_distance_dictionary[pair[1]][editdistance_value] for editdistance_value in distances if editdistance_value in edit_distance_dictionary[pair[1]]]):
-            community_validity.append(pair[0])
-            community_validity.append(pair[1])
-        else:
-            continue
+    for pair in sorted(conflicts):
+        community_validity.append(starter_community[pair[0]])
+        community_validity.append(starter_community[pair[1]])
     return community_validity
 
-def withoutcommunityinput(edit_distance_dictionary,editdistance_value):
+def withoutcommunityinput(graph,editdistance_value,rng=random):
     community = []
     smallest = 500 #number used that is bigger than number of possibilities
     EDnot_in_dict=[]# empty list but will contain members with no values at edit distance
-    for key in edit_distance_dictionary: #loop through keys in the dictionaty made above
-        if editdistance_value not in edit_distance_dictionary[key]:#Check if the key has an editdistance of input
-            EDnot_in_dict.append(key) #if not append the list
+    counts=graph.distance_counts(editdistance_value).tolist()# number of neighbours of each sequence at the edit distance
+    for row in range(len(graph)): #loop through sequences in the graph
+        if not counts[row]:#Check if the sequence has neighbours at the edit distance
+            EDnot_in_dict.append(graph.ids[row]) #if not append the list
         else: # if it does have that edit distqance
-            if len(edit_distance_dictionary[key][editdistance_value])<smallest:#Check if the length of the values for the key at edit distance of input is less than the smallest number
-                smallest= len(edit_distance_dictionary[key][editdistance_value])#set smallest to the length of the smallest list
-                smallest_sequence = key#Set smallest seqeunce equal to the key
+            if counts[row]<smallest:#Check if the number of neighbours at the edit distance is less than the smallest number
+                smallest=counts[row]#set smallest to the smallest number of neighbours
+                smallest_sequence = graph.ids[row]#Set smallest seqeunce equal to the sequence
     if not EDnot_in_dict:# check if this list is empty
         community.append(smallest_sequence) # if it is empty append community with smallest sequence
     else: # if not empty
-        community.append(random.choice(EDnot_in_dict))# choose random sequence from list to append community
+        community.append(rng.choice(EDnot_in_dict))# choose random sequence from list to append community
     return community
 
-def loopforCommunity(community,editdistance_value,edit_distance_dictionary):
-    not_community=[]#set of members to not put in community
-    not_community_set = set()
+def loopforCommunity(community,editdistance_value,graph,rng=random):
+    counts=graph.distance_counts(editdistance_value).tolist()# number of neighbours of each sequence at the edit distance
+    smallest=500 #sequences with this many neighbours or more are never picked
+
+    #candidates are kept in buckets by their number of neighbours at the edit distance,
+    #position holds the index of each candidate in its bucket so it can be removed in constant time
+    buckets=defaultdict(list)
+    position=[0]*len(graph)
+    for row, count in enumerate(counts):
+        if count < smallest:
+            position[row]=len(buckets[count])
+            buckets[count].append(row)
+    bucket_counts=sorted(count for count in buckets if count)
+    not_community_set=bytearray(len(graph))#flags for members to not put in community
 
-    distances=list(range(editdistance_value)) #Create a list of numbers below edit distance value
-    distances.append(editdistance_value)# append edit distance value to list
+    def exclude(row):
+        if not_community_set[row]:
+            return
+        not_community_set[row]=1
+        if counts[row] < smallest:
+            bucket=buckets[counts[row]]
+            last=bucket.pop()
+            if last != row:
+                bucket[position[row]]=last
+                position[last]=position[row]
 
-    #setup not_community list
-    not_community_set.update(community)
+    #setup not_community flags, identifiers missing from the alignment have no neighbours
     for taxa in community:
-        for edistance in distances:
-            if edistance in edit_distance_dictionary[taxa]:
-                not_community_set.update(edit_distance_dictionary[taxa][edistance])
+        if taxa in graph.index:
+            row=graph.index[taxa]
+            exclude(row)
+            for neighbour in graph.neighbours_within(row, editdistance_value).tolist():
+                exclude(neighbour)
 
+    next_count=0
     while True:# while there are members to loop through
-        smallest=500
-        smallest_sequence=""
-        EDnot_in_dict=[]
-        shuffle_keys=list(edit_distance_dictionary.keys())
-        random.shuffle(shuffle_keys)
-        for key in shuffle_keys:# loop through keys agains
-            #member = False # set to false to keep looping
-            if key in not_community_set:#check if key is already in the communitiy
-                continue #if key in community skip
-            else:#if key is not in community check if it is the value for the community members
-                if editdistance_value in edit_distance_dictionary[key]:# check if edit value is  present for key
-                    if len(edit_distance_dictionary[key][editdistance_value])<smallest:#Check if the length of the values for the key at edit distance of input is less than the smallest number
-                        smallest= len(edit_distance_dictionary[key][editdistance_value])#set smallest to the length of the smallest list
-                        smallest_sequence= key#Set smallest seqeunce equal to the key
-                else: # if edit value isnt present in key
-                    EDnot_in_dict.append(key) # add to list
-        if smallest_sequence or EDnot_in_dict: # if either of these have a value
-            if EDnot_in_dict: # if this list is not empty
-                community.append(random.choice(EDnot_in_dict)) # choose random member from list
-            else: # if it is empty
-                community.append(smallest_sequence) # append community with smallest sequence
-
-            #update not_set
-            not_community_set.add(community[-1])
-            for edistance in distances:
-                if edistance in edit_distance_dictionary[community[-1]]:
-                    not_community_set.update(edit_distance_dictionary[community[-1]][edistance])
-        else: # if they dont have a value
-            break # break because we are out of members
+        if buckets[0]: # sequences without neighbours at the edit distance are picked first
+            row=rng.choice(buckets[0]) # choose random member from list
+        else:
+            #counts never change so a bucket that is empty stays empty
+            while next_count < len(bucket_counts) and not buckets[bucket_counts[next_count]]:
+                next_count+=1
+            if next_count == len(bucket_counts):
+                break # break because we are out of members
+            row=rng.choice(buckets[bucket_counts[next_count]]) # random member with the smallest number of neighbours
+        community.append(graph.ids[row])
+
+        #update not_set
+        exclude(row)
+        for neighbour in graph.neighbours_within(row, editdistance_value).tolist():
+            exclude(neighbour)
 
     return community
 
-def straininfo(metadata):
-    strain_info ={} # empty dicionary for strain information
-    for i, line in enumerate(metadata): # count lines in file
-        line=line.strip()
-        if i == 0:
-            metadata_header=line
+def restartSeeds(seed, restarts):
+    #the first restart uses --p-seed itself so it builds the same community as a single run
+    seeder=random.Random(seed)
+    return [seed]+[seeder.getrandbits(64) for restart in range(restarts-1)]
+
+def restartSeed(seed):
+    #integer seeds can be given to --p-seed to build the same community again
+    return " (--p-seed {})".format(seed) if isinstance(seed, int) else ""
+
+workergraph=None
+
+def sharedArray(array):
+    import numpy as np
+    shared=multiprocessing.RawArray(ctypes.c_uint8, max(1, array.nbytes))
+    np.frombuffer(shared, dtype=np.uint8)[:array.nbytes]=array.view(np.uint8)
+    return shared, array.dtype.str, len(array)
+
+def initCommunityWorker(ids, arrays, max_distance):
+    #workers view the parent's neighbour graph in shared memory rather than receiving a copy
+    import numpy as np
+    global workergraph
+    offsets, neighbours, distances=(np.frombuffer(shared, dtype=dtype, count=count) for shared, dtype, count in arrays)
+    workergraph=NeighbourGraph(ids, offsets, neighbours, distances, max_distance)
+
+def workerCommunity(work):
+    #each community draws from its own generator, so the caller's random module is left alone
+    seed, starter_community, editdistance_value=work
+    rng=random.Random(seed)
+    if starter_community is None:
+        community=withoutcommunityinput(workergraph,editdistance_value,rng)
+    else:
+        community=list(starter_community)
+    return loopforCommunity(community,editdistance_value,workergraph,rng)
+
+def restartCommunities(graph, editdistance_value, starter_community, seeds, jobs=1):
+    #one community for each seed, built in a process pool when jobs > 1
+    global workergraph
+    work=[(seed, starter_community, editdistance_value) for seed in seeds]
+    if jobs > 1 and len(seeds) > 1:
+        arrays=[sharedArray(array) for array in (graph.offsets, graph.neighbours, graph.distances)]
+        with multiprocessing.Pool(min(jobs, len(seeds)), initializer=initCommunityWorker, initargs=(graph.ids, arrays, graph.max_distance)) as pool:
+            return pool.map(workerCommunity, work)
+    workergraph=graph
+    return [workerCommunity(item) for item in work]
+
+def reportRestarts(communities):
+    sizes=sorted(len(community) for community in communities)
+    print("Community size across {} restarts: smallest {}, median {}, largest {}".format(len(sizes), sizes[0], sizes[len(sizes)//2], sizes[-1]))
+    print("Members\tRestarts")
+    for size in sorted(set(sizes), reverse=True):
+        print("{}\t{}".format(size, sizes.count(size)))
+
+def largestCommunities(communities, keep=1):
+    #(restart, community) of the keep largest distinct communities, earlier restarts first among equal sizes
+    largest=[]
+    seen=set()
+    for restart in sorted(range(len(communities)), key=lambda restart: -len(communities[restart])):
+        members=frozenset(communities[restart])
+        if members not in seen:
+            seen.add(members)
+            largest.append((restart, communities[restart]))
+            if len(largest) == keep:
+                break
+    return largest
+
+def thresholdComponents(graph, editdistance_value):
+    #neighbours within the edit distance of each sequence and the connected components they form
+    adjacency=[graph.neighbours_within(row, editdistance_value).tolist() for row in range(len(graph))]
+    component_of=[-1]*len(graph)
+    components=[]
+    for start in range(len(graph)):
+        if component_of[start] < 0:
+            component_of[start]=len(components)
+            component=[start]
+            for row in component:
+                for neighbour in adjacency[row]:
+                    if component_of[neighbour] < 0:
+                        component_of[neighbour]=len(components)
+                        component.append(neighbour)
+            components.append(sorted(component))
+    return adjacency, components
+
+def improveComponent(work):
+    #swap local search on one component: free sequences are added, a member with two non-neighbouring
+    #sequences whose only member neighbour it is makes way for them, and a random sequence is forced in when stuck
+    adjacency, solution, fixed, banned, time_limit, seed=work
+    deadline=time.perf_counter()+time_limit
+    rng=random.Random(seed)
+    size=len(adjacency)
+    neighbour_sets=[set(neighbours) for neighbours in adjacency]
+    in_solution=[False]*size
+    tight=[0]*size#number of members among the neighbours of each sequence
+    queue=deque()
+    def insert(row):
+        in_solution[row]=True
+        for neighbour in adjacency[row]:
+            tight[neighbour]+=1
+    def remove(row):
+        in_solution[row]=False
+        for neighbour in adjacency[row]:
+            tight[neighbour]-=1
+    def touch(row):
+        #queue the sequences around a removed member, which may now be free or swapped in
+        for neighbour in adjacency[row]:
+            if not in_solution[neighbour]:
+                queue.append(neighbour)
+                if tight[neighbour] == 1:
+                    queue.extend(member for member in adjacency[neighbour] if in_solution[member])
+    def localSearch():
+        while queue and time.perf_counter() < deadline:
+            row=queue.popleft()
+            if not in_solution[row]:
+                if not tight[row] and not banned[row]:
+                    insert(row)
+                    queue.append(row)
+                continue
+            if fixed[row]:
+                continue
+            candidates=[neighbour for neighbour in adjacency[row] if tight[neighbour] == 1 and not in_solution[neighbour] and not banned[neighbour]]
+            pair=next(((first, second) for position, first in enumerate(candidates)
+                       for second in candidates[position+1:] if second not in neighbour_sets[first]), None)
+            if pair is not None:
+                remove(row)
+                insert(pair[0])
+                insert(pair[1])
+                touch(row)
+                queue.extend(pair)
+    for row in solution:
+        insert(row)
+    queue.extend(range(size))
+    localSearch()
+    best=[row for row in range(size) if in_solution[row]]
+    allowed=[row for row in range(size) if not banned[row]]
+    stalled=0
+    while stalled < max(100, 2*size) and time.perf_counter() < deadline:
+        row=rng.choice(allowed)
+        stalled+=1
+        if in_solution[row]:
+            continue
+        #the neighbours of fixed members are banned, so only free members are pushed out
+        removed=[neighbour for neighbour in adjacency[row] if in_solution[neighbour]]
+        for member in removed:
+            remove(member)
+        insert(row)
+        for member in removed:
+            touch(member)
+        queue.append(row)
+        localSearch()
+        members=sum(in_solution)
+        if members > len(best):
+            best=[row for row in range(size) if in_solution[row]]
+            stalled=0
+        elif members < len(best):
+            queue.clear()
+            for row in range(size):
+                in_solution[row]=False
+                tight[row]=0
+            for row in best:
+                insert(row)
+    return best
+
+def improveCommunity(graph, editdistance_value, community, starter_community=None, time_limit=60, jobs=1, seed=None):
+    #enlarge a community by local search within time_limit seconds, each connected component of the
+    #sequences within the edit distance is improved on its own in a process pool when jobs > 1
+    started=time.perf_counter()
+    adjacency, components=thresholdComponents(graph, editdistance_value)
+    members=set(graph.index[member] for member in community if member in graph.index)
+    fixed=set(graph.index[member] for member in starter_community or () if member in graph.index)
+    banned=set(neighbour for row in fixed for neighbour in adjacency[row])
+    #isolated sequences are members of every largest community and need no search
+    improved=set(component[0] for component in components if len(component) == 1)
+    searched=[]
+    for component in components:
+        component_members=[row for row in component if row in members]
+        #a connected component of more than one sequence never has more members than sequences less one
+        if len(component) == 1 or len(component_members) == len(component)-1:
+            improved.update(component_members)
         else:
-            fields=line.split("\t") # split on tabs
-            strain_info[fields[0]]=fields[1:]
-    return (strain_info, metadata_header)
+            searched.append((component, component_members))
+    #the largest components are started first and get the largest share of the time of each process
+    searched.sort(key=lambda item: -len(item[0]))
+    searched_rows=sum(len(component) for component, component_members in searched)
+    seeder=random.Random(seed)
+    #finding the components counts towards the time limit
+    time_limit=max(0, time_limit-(time.perf_counter()-started))
+    work=[]
+    for component, component_members in searched:
+        local={row: position for position, row in enumerate(component)}
+        work.append(([[local[neighbour] for neighbour in adjacency[row]] for row in component],
+                     [local[row] for row in component_members],
+                     [row in fixed for row in component], [row in banned for row in component],
+                     min(time_limit, time_limit*min(jobs, len(searched))*len(component)/searched_rows),
+                     seeder.getrandbits(64)))
+    if jobs > 1 and len(work) > 1:
+        with multiprocessing.Pool(min(jobs, len(work))) as pool:
+            solutions=pool.map(improveComponent, work, chunksize=1)
+    else:
+        solutions=[improveComponent(item) for item in work]
+    for (component, component_members), solution in zip(searched, solutions):
+        improved.update(component[position] for position in solution)
+    print("Local search over {} components of {} sequences, {} sequences have no neighbours within the edit distance".format(
+        len(searched), searched_rows, sum(len(component) == 1 for component in components)))
+    #members keep their order and added members follow in the order of the alignment
+    kept=[member for member in community if member not in graph.index or graph.index[member] in improved]
+    return kept+[graph.ids[row] for row in sorted(improved-members)]
+
+def straininfo(metadata):
+    #the metadata is streamed for each output, so a pipe is read into memory once to be read again
+    if not metadata.seekable():
+        metadata=io.StringIO(metadata.read())
+    return metadata
 
 def outfile(editdistance_value):
     outputfile=open('Community_ED{}.txt'.format(editdistance_value),"w+")
     return outputfile
 
-def joinstrain(metadata,community,outfile_name,metadata_header):
-    outfile_name.write("{}\n".format(metadata_header))
-    for key, value in metadata.items(): # loop through keys and values in strain dictionary
-        if key in community: # if that key is found in community
-            outfile_name.write("{}\t{}\n".format(key, "\t".join(value)))
+def joinstrain(metadata,community,outfile_name,community_order=False):
+    #streams the metadata rows past a set of the community, only the community's rows are kept
+    #and only to write them in community order. Returns the members without a metadata row
+    metadata.seek(0)
+    outfile_name.write("{}\n".format(metadata.readline().strip()))
+    members=set(community)
+    rows={}
+    for line in metadata:
+        line=line.strip()
+        key=line.split("\t", 1)[0]
+        if key in members:
+            members.discard(key)
+            if community_order:
+                rows[key]=line
+            else:
+                outfile_name.write("{}\n".format(line))
+    if community_order:
+        outfile_name.write("".join("{}\n".format(rows[key]) for key in community if key in rows))
+    return [key for key in community if key in members]
+
+def reportMissingMetadata(missing):
+    if missing:
+        print("{} community members have no metadata row: {}".format(len(missing), ",".join(missing)), file=sys.stderr)
 
 def outputnostrain(outfile_name,community):
     for sequence_id in community:
@@ -492,6 +2257,87 @@ def outputfasta(sequence_dict,community,editdistance_value):
         for sequence_id in community:
             fasta_file.write(">{}\n{}\n".format(sequence_id,sequence_dict[sequence_id]))
 
+def proportionSubsample(grouping_dict, goal_prop, num_taxa=None, num_enforce=False, rng=random):
+    #members of each group in goal_prop, shuffled with rng and cut to the counts closest to the goal proportions,
+    #with the number of members kept and their proportions
+    grouping_dict = {k: grouping_dict[k] for k in goal_prop}
+    #shuffle taxa
+    for group in grouping_dict:
+        rng.shuffle(grouping_dict[group])
+    #only the number of taxa kept in each group changes while minimising,
+    #the first taxa of each shuffled group are kept at the end
+    group_counts = {k: len(grouping_dict[k]) for k in grouping_dict}
+    current_total = sum(group_counts.values())
+    current_props, error_dict, current_sse = proportionErrors(group_counts, current_total, goal_prop)
+
+    #loop to minimize sum of squared "errors"
+    while True:
+        #find group with maximum difference to goal proportion
+        max_error = max(error_dict.items(), key=operator.itemgetter(1))
+        #if max diffrence is zero or negative can not improve and break
+        #or if max_error group only has one member.
+        if max_error[1] < 0 or group_counts[max_error[0]] == 1:
+            break
+        #if num_enforce break early if below num_taxa
+        if num_enforce and (current_total - 1) < num_taxa:
+            break
+        #Remove taxa from group with max error and recalculate SSE
+        group_counts[max_error[0]] -= 1
+        temp_props, temp_error_dict, temp_sse = proportionErrors(group_counts, current_total - 1, goal_prop)
+        #Test if new SSE is less then current and proceed accordingly,
+        #if num_taxa continue even if temp_sse >= current_sse
+        if temp_sse < current_sse or (num_taxa and current_total > num_taxa):
+            current_total -= 1
+            current_props = temp_props
+            current_sse = temp_sse
+            error_dict = temp_error_dict
+        else:
+            group_counts[max_error[0]] += 1
+            break
+    grouping_dict = {k: grouping_dict[k][:group_counts[k]] for k in grouping_dict}
+    return grouping_dict, current_total, current_props
+
+def proportionErrors(group_counts, total, goal_prop):
+    #proportion of each group, its difference to the goal proportion and the sum of squared differences
+    props = {k: group_counts[k]/total for k in group_counts}
+    error_dict = {}
+    sse = 0
+    for group in props:
+        error_dict[group] = props[group] - goal_prop[group]
+        sse += (props[group] - goal_prop[group])**2
+    return props, error_dict, sse
+
+def replicateSample(work):
+    #indices of one subsample, the members a single run of subsample with this seed keeps
+    seed, community_size, num_taxa = work
+    return random.Random(seed).sample(range(community_size), num_taxa)
+
+def replicateSamples(work, jobs=1):
+    #yields the subsample of each work item in order, drawn in a process pool when jobs > 1
+    if jobs > 1 and len(work) > 1:
+        with multiprocessing.Pool(min(jobs, len(work))) as pool:
+            yield from pool.imap(replicateSample, work, chunksize=max(1, len(work)//(jobs*4)))
+    else:
+        yield from map(replicateSample, work)
+
+def replicateSubsamples(community_list, header, taxa_sizes, seeds, prefix, single_output=False, jobs=1):
+    #the community is parsed and each member formatted once, every replicate of every size reuses them
+    members = ["\t".join(member) for member in community_list]
+    replicates = [(num_taxa, replicate) for num_taxa in taxa_sizes for replicate in range(1, len(seeds) + 1)]
+    work = [(seeds[replicate - 1], len(members), num_taxa) for num_taxa, replicate in replicates]
+    samples = replicateSamples(work, jobs)
+    if single_output:
+        with open("{}_replicates.txt".format(prefix), "w") as subsample_output:
+            subsample_output.write("{}\tSize\tReplicate\n".format("\t".join(header)))
+            for (num_taxa, replicate), sample in zip(replicates, samples):
+                subsample_output.write("".join("{}\t{}\t{}\n".format(members[member], num_taxa, replicate) for member in sample))
+    else:
+        for (num_taxa, replicate), sample in zip(replicates, samples):
+            with open("{}{}_replicate{}.txt".format(prefix, num_taxa, replicate), "w") as subsample_output:
+                subsample_output.write("{}\n".format("\t".join(header)))
+                subsample_output.write("".join("{}\n".format(members[member]) for member in sample))
+    print("Wrote {} replicates of {} taxa".format(len(seeds), ",".join(str(num_taxa) for num_taxa in taxa_sizes)))
+
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
     return abs(a-b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
 
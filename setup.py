@@ -19,7 +19,7 @@ with open(path.join(here, 'README.md'), encoding='utf-8') as f:
 setup(name = "disco-microbe",
       setup_requires=['pytest-runner'],
       tests_require=['pytest'],
-      install_requires=['biopython'],
+      install_requires=['numpy'],
       packages = ["disco_microbe"],
       python_requires='~=3.5',
       entry_points = {
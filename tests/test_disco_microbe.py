@@ -0,0 +1,193 @@
+import os
+import sys
+import glob
+import random
+import subprocess
+from itertools import islice
+
+import pytest
+
+repository_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_dir)
+
+from disco_microbe import disco_microbe
+
+test_alignment=os.path.join(repository_dir, "tests", "aligned-dna-sequences.fasta")
+
+def disco(*arguments, cwd, check=True):
+    environment=dict(os.environ, PYTHONPATH=repository_dir)
+    return subprocess.run([sys.executable, "-m", "disco_microbe.disco_microbe"]+list(arguments), cwd=str(cwd), env=environment,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120, check=check)
+
+def iupacSequences(count=40, length=60, seed=1):
+    #variants of one sequence with substitutions to any IUPAC code or a gap, so many pairs are within a few differences
+    rng=random.Random(seed)
+    codes="ACGTURYSWKMBDHVN-"
+    ancestor=[rng.choice("ACGT") for position in range(length)]
+    sequences={}
+    for number in range(count):
+        sequence=list(ancestor)
+        for position in rng.sample(range(length), rng.randint(0, 6)):
+            sequence[position]=rng.choice(codes)
+        sequences["seq{}".format(number)]="".join(sequence)
+    return sequences
+
+def writeFasta(path, sequences):
+    path.write_text("".join(">{}\n{}\n".format(taxa, sequence) for taxa, sequence in sequences.items()))
+
+def readCommunity(path):
+    return path.read_text().split()
+
+def databasePairs(path):
+    #the pairs of a tsv database regardless of the order of lines and of the two sequences of a line
+    pairs=set()
+    with open(str(path)) as database_file:
+        for line in database_file:
+            first, second, distance=line.split()
+            pairs.add((min(first, second), max(first, second), int(distance)))
+    return pairs
+
+def createdDatabase(directory, extension="txt"):
+    databases=glob.glob(os.path.join(str(directory), "distance_dictionary_*.{}".format(extension)))
+    assert len(databases) == 1
+    return databases[0]
+
+def graphPairs(graph, editdistance_value):
+    return {(row, int(column), int(graph.distance(row, column))) for row in range(len(graph))
+            for column in graph.neighbours_within(row, editdistance_value) if row < column}
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_jobs_with_identical_sequences(tmp_path, engine):
+    #every column is dropped once the identical sequences are collapsed, which used to stop the distance workers starting
+    (tmp_path/"identical.fasta").write_text(">a\nACGT\n>b\nACGT\n>c\nACGT\n")
+    disco("create", "--i-alignment", "identical.fasta", "--p-editdistance", "1", "--p-seed", "1", "--p-jobs", "2",
+          "--p-distance-engine", engine, "--o-community-list", "community.txt", cwd=tmp_path)
+    assert (tmp_path/"community.txt").read_text().split() == ["a"]
+
+@pytest.mark.parametrize("threshold", [False, True])
+def test_numpy_engine_matches_customeditdistance(threshold):
+    sequences=iupacSequences()
+    graph=disco_microbe.editDistanceDictionary(disco_microbe.compactAlignment(sequences)[0], 4, "numpy", threshold=threshold, write_database=False)
+    ids=list(sequences)
+    expected=set()
+    for row, column in ((row, column) for row in range(len(ids)) for column in range(row+1, len(ids))):
+        distance=disco_microbe.customeditdistance(sequences[ids[row]], sequences[ids[column]])
+        if distance <= 4:
+            expected.add((row, column, distance))
+    assert expected
+    assert graphPairs(graph, 4) == expected
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_threshold_mode_builds_the_same_community(tmp_path, engine):
+    for mode in ("full", "threshold"):
+        (tmp_path/mode).mkdir()
+        disco("create", "--i-alignment", test_alignment, "--p-editdistance", "3", "--p-seed", "10", "--p-distance-engine", engine,
+              "--o-community-list", "community.txt", *(["--p-threshold-mode"] if mode == "threshold" else []), cwd=tmp_path/mode)
+    assert readCommunity(tmp_path/"full"/"community.txt") == readCommunity(tmp_path/"threshold"/"community.txt")
+
+def test_convert_round_trip(tmp_path):
+    writeFasta(tmp_path/"alignment.fasta", iupacSequences())
+    disco("create", "--i-alignment", "alignment.fasta", "--p-editdistance", "3", "--p-seed", "1", cwd=tmp_path)
+    database=createdDatabase(tmp_path)
+    disco("convert", "--i-distance-database", database, "--o-distance-database", "database.bin", cwd=tmp_path)
+    disco("convert", "--i-distance-database", "database.bin", "--o-distance-database", "round_trip.txt", cwd=tmp_path)
+    assert databasePairs(tmp_path/"round_trip.txt") == databasePairs(database)
+
+@pytest.mark.parametrize("database_format", ["tsv", "binary"])
+def test_update_database_matches_rebuild(tmp_path, database_format):
+    sequences=iupacSequences()
+    writeFasta(tmp_path/"alignment.fasta", sequences)
+    writeFasta(tmp_path/"first.fasta", dict(islice(sequences.items(), 25)))
+    extension="bin" if database_format == "binary" else "txt"
+    for run in ("first", "rebuild"):
+        (tmp_path/run).mkdir()
+        disco("create", "--i-alignment", "../{}.fasta".format("first" if run == "first" else "alignment"), "--p-editdistance", "3",
+              "--p-seed", "1", "--p-database-format", database_format, "--o-community-list", "community.txt", cwd=tmp_path/run)
+    updated=createdDatabase(tmp_path/"first", extension)
+    (tmp_path/"update").mkdir()
+    disco("create", "--i-alignment", "../alignment.fasta", "--p-editdistance", "3", "--p-seed", "1", "--i-distance-database", updated,
+          "--p-update-database", "--o-community-list", "community.txt", cwd=tmp_path/"update")
+    rebuilt=createdDatabase(tmp_path/"rebuild", extension)
+    if database_format == "binary":
+        for name, database in (("updated", updated), ("rebuilt", rebuilt)):
+            disco("convert", "--i-distance-database", database, "--o-distance-database", "{}.txt".format(name), cwd=tmp_path)
+        updated, rebuilt=tmp_path/"updated.txt", tmp_path/"rebuilt.txt"
+    assert databasePairs(updated) == databasePairs(rebuilt)
+    assert readCommunity(tmp_path/"update"/"community.txt") == readCommunity(tmp_path/"rebuild"/"community.txt")
+
+@pytest.mark.parametrize("sequences", [iupacSequences(), os.path.basename(test_alignment)])
+def test_block_index_finds_every_pair(sequences):
+    if isinstance(sequences, str):
+        with open(test_alignment, "rb") as alignment_file:
+            sequences=disco_microbe.sequenceDictionary(alignment_file)
+    distance_dict=disco_microbe.compactAlignment(sequences)[0]
+    for editdistance_value in range(1, 6):
+        compared=disco_microbe.editDistanceDictionary(distance_dict, editdistance_value, "numpy", threshold=True, write_database=False)
+        indexed=disco_microbe.editDistanceDictionary(distance_dict, editdistance_value, "numpy", threshold=True, block_index=True, write_database=False)
+        assert graphPairs(indexed, editdistance_value) == graphPairs(compared, editdistance_value)
+
+def test_resumed_run_matches_uninterrupted(tmp_path):
+    with open(test_alignment, "rb") as alignment_file:
+        sequences=disco_microbe.uniqueSequences(disco_microbe.compactAlignment(disco_microbe.sequenceDictionary(alignment_file))[0])[1]
+    work_dir=str(tmp_path/"work")
+    #the first run is stopped part of the way through its blocks
+    rows=disco_microbe.checkpointRows(disco_microbe.Checkpoint(work_dir, sequences, None, block_pairs=2000), sequences, "python", 1, None)
+    list(islice(rows, len(sequences)//2))
+    rows.close()
+    assert len(os.listdir(work_dir)) > 1
+    resumed=list(disco_microbe.checkpointedDistanceRows(sequences, "python", 1, None, work_dir, resume=True))
+    uninterrupted=list(disco_microbe.pairwiseDistanceRows(sequences, "python"))
+    assert len(resumed) == len(uninterrupted)
+    for (row, columns, distances), (expected_row, expected_columns, expected_distances) in zip(resumed, uninterrupted):
+        assert row == expected_row
+        assert columns.tolist() == expected_columns.tolist()
+        assert distances.tolist() == expected_distances.tolist()
+    assert os.listdir(work_dir) == []
+
+def test_merge_rejects_mismatched_or_missing_shards(tmp_path):
+    writeFasta(tmp_path/"other.fasta", iupacSequences())
+    for shard_number in range(1, 4):
+        disco("shard", "--i-alignment", test_alignment, "--p-shard", "{}/3".format(shard_number), "--o-shard", "shard{}.npz".format(shard_number), cwd=tmp_path)
+    disco("shard", "--i-alignment", test_alignment, "--p-shard", "1/2", "--o-shard", "half.npz", cwd=tmp_path)
+    disco("shard", "--i-alignment", "other.fasta", "--p-shard", "3/3", "--o-shard", "other.npz", cwd=tmp_path)
+    for shards, message in ((["shard1.npz", "shard2.npz"], "missing"),
+                            (["shard1.npz", "shard2.npz", "other.npz"], "different alignment"),
+                            (["shard2.npz", "shard3.npz", "half.npz"], "the other shards are of"),
+                            (["shard1.npz", "shard1.npz", "shard2.npz", "shard3.npz"], "are both shard")):
+        merged=disco("merge", "--i-alignment", test_alignment, "--i-shards", *shards, "--o-distance-database", "merged.txt", cwd=tmp_path, check=False)
+        assert merged.returncode == 1
+        assert message in merged.stderr.decode()
+        assert not (tmp_path/"merged.txt").exists()
+    disco("merge", "--i-alignment", test_alignment, "--i-shards", "shard3.npz", "shard1.npz", "shard2.npz", "--o-distance-database", "merged.txt", cwd=tmp_path)
+    (tmp_path/"create").mkdir()
+    disco("create", "--i-alignment", test_alignment, "--p-editdistance", "3", "--p-seed", "1", cwd=tmp_path/"create")
+    assert databasePairs(tmp_path/"merged.txt") == databasePairs(createdDatabase(tmp_path/"create"))
+
+@pytest.mark.parametrize("options, counts", [([], {"A": 20, "B": 12, "C": 8}),
+                                             (["--p-num-taxa", "10", "--p-taxa-num-enforce"], {"A": 5, "B": 3, "C": 2})])
+def test_proportion_counts(tmp_path, options, counts):
+    members=[("member{}".format(number), group) for number, group in enumerate("A"*20+"B"*12+"C"*8+"D"*5)]
+    (tmp_path/"community.txt").write_text("ID\tGroup\n"+"".join("{}\t{}\n".format(*member) for member in members))
+    (tmp_path/"proportions.txt").write_text("A\t0.5\nB\t0.3\nC\t0.2\nD\t0\n")
+    disco("subsample", "--i-input-community", "community.txt", "--p-proportion", "proportions.txt", "--p-group-by", "Group",
+          "--p-seed", "1", "--o-subsample", "subsample", *options, cwd=tmp_path)
+    groups=[line.split("\t")[1] for line in (tmp_path/"subsample.txt").read_text().splitlines()[1:]]
+    assert {group: groups.count(group) for group in set(groups)} == counts
+
+def test_local_search_keeps_a_valid_community(tmp_path):
+    with open(test_alignment, "rb") as alignment_file:
+        sequences=disco_microbe.sequenceDictionary(alignment_file)
+    graph=disco_microbe.editDistanceDictionary(disco_microbe.compactAlignment(sequences)[0], 5, "numpy", threshold=True, write_database=False)
+    #included strains that are valid at the edit distance, taken from across the alignment
+    include=[]
+    for taxa in list(sequences)[::40]:
+        if not disco_microbe.validateCommunity(include+[taxa], 5, graph):
+            include.append(taxa)
+    (tmp_path/"include.txt").write_text("".join("{}\n".format(taxa) for taxa in include))
+    for run, options in (("greedy", []), ("search", ["--p-time-limit", "2"])):
+        disco("create", "--i-alignment", test_alignment, "--p-editdistance", "5", "--p-seed", "2", "--p-threshold-mode",
+              "--p-include-strains", "include.txt", "--o-community-list", "{}.txt".format(run), *options, cwd=tmp_path)
+    community=readCommunity(tmp_path/"search.txt")
+    assert disco_microbe.validateCommunity(community, 5, graph) == []
+    assert set(include) <= set(community)
+    assert len(community) >= len(readCommunity(tmp_path/"greedy.txt"))